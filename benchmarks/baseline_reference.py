@@ -0,0 +1,93 @@
+#usr/bin/env python
+import os, sys, ast, json, subprocess
+from itertools import islice, cycle
+
+# ------------------------------
+#   MorphoMetrix Baseline Reference
+#   Computes the reference annotation of benchmark.py with the measuring code of the
+#   original release (commit BASELINE_COMMIT): bezier/gauss_legendre arc length,
+#   root_scalar bisection for width stations, QLineF lengths and angles, shoelace area
+#   over the polygon its intersect handler builds. Writes benchmarks/reference.json
+#
+#   Usage: python benchmarks/baseline_reference.py      (needs git history and scipy)
+# ------------------------------
+
+BASELINE_COMMIT = "61082ca"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from scipy.linalg import pascal
+from scipy.sparse import diags
+from scipy.optimize import root_scalar
+from PySide6.QtCore import QLineF, QPointF
+from benchmark import REFERENCE_ANNOTATION, REFERENCE_HANDLES, REFERENCE_FILE
+
+# bezier and gauss_legendre exactly as in baseline graphicsview.py
+def baseline_functions():
+    source = subprocess.run(["git", "show", BASELINE_COMMIT + ":morphometrix/graphicsview.py"],
+                            cwd = ROOT, capture_output = True, text = True, check = True).stdout
+    namespace = {"np": np, "pascal": pascal, "diags": diags, "islice": islice, "cycle": cycle}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.FunctionDef) and node.name in ("bezier", "gauss_legendre"):
+            exec(ast.get_source_segment(source, node), namespace)
+    return namespace["bezier"], namespace["gauss_legendre"]
+
+# Clicks as baseline line items: first line starts and ends at first click, every later click ends a line
+def lines_of(points):
+    P = [QPointF(x, y) for x, y in points]
+    return [QLineF(P[0], P[1])] + [QLineF(P[i], P[i + 1]) for i in range(1, len(P) - 1)]
+
+# Baseline calculate_curve and measure_widths (stations only, handles are placed by REFERENCE_HANDLES)
+def bezier_length_and_stations(bezier, gauss_legendre, points, numwidths):
+    P = np.array(points, dtype = float)
+    kb = len(P) - 1
+    Q = kb*np.diff(P, axis = 0)
+    length = gauss_legendre(b = 1, f = bezier, P = Q, k = kb - 1, arc = True)
+    s_i = np.linspace(0, 1, numwidths + 2)[1:-1]
+    t_i = np.array([root_scalar(gauss_legendre, x0 = s_i, bracket = [-1,1], method = "bisect",
+                                args = (bezier, Q, kb - 1, True, s, length)).root for s in s_i])
+    return length, bezier(t_i, P = P, k = kb)
+
+# Baseline intersect_handler polygon on the final click, closed by calculate_area (shoelace)
+def baseline_area(points):
+    lines = lines_of(points[:-1])
+    lines.append(QLineF(lines[-1].p2(), QPointF(*points[-1])))     # Line to cursor at final click
+    for i in range(len(lines) - 2):
+        kind, point = lines[-1].intersects(lines[i])
+        if kind == QLineF.IntersectionType.BoundedIntersection:
+            polygon = [line.p2() for line in lines[i:]] + [point]
+            break
+    else:
+        raise ValueError("Reference area outline does not close")
+    S1 = sum(polygon[i].x()*polygon[i+1].y() - polygon[i].y()*polygon[i+1].x() for i in range(len(polygon) - 1))
+    conct = polygon[-1].x()*polygon[0].y() - polygon[-1].y()*polygon[0].x()
+    return 0.5*abs(S1 + conct)
+
+def reference_values(numwidths = 9):
+    bezier, gauss_legendre = baseline_functions()
+    values = {}
+    for annotation in REFERENCE_ANNOTATION["measurements"]:
+        name, points = annotation["name"], annotation["points"]
+        match annotation["type"], annotation.get("fit"):
+            case "length", "bezier":
+                length, stations = bezier_length_and_stations(bezier, gauss_legendre, points, numwidths)
+                values["length/%s/" % name] = length
+                for i, (x, y) in enumerate(stations):   # Side A handle straight above station
+                    values["width/%s/%.1f" % (name, (i + 1)/(numwidths + 1)*100)] = abs(REFERENCE_HANDLES[0] - y)
+            case "length", "piecewise":
+                values["length/%s/" % name] = sum(line.length() for line in lines_of(points))
+            case "area", _:
+                values["area/%s/" % name] = baseline_area(points)
+            case "angle", _:
+                lines = lines_of(points)
+                values["angle/%s/" % name] = lines[0].angleTo(lines[1])
+    return values
+
+if __name__ == "__main__":
+    values = reference_values()
+    with open(REFERENCE_FILE, "w") as f:
+        json.dump({"source": "baseline " + BASELINE_COMMIT + " (benchmarks/baseline_reference.py)", "values": values}, f, indent = 1)
+    for key, value in values.items():
+        print("%-24s %.12g" % (key, value))
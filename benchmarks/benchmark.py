@@ -0,0 +1,293 @@
+#usr/bin/env python
+import os, sys, csv, json, time, platform, argparse, tracemalloc
+from datetime import date
+
+# ------------------------------
+#   MorphoMetrix Benchmarks
+#   Times geometry kernels and scene operations headlessly (Qt offscreen platform)
+#   and checks measured values of a reference annotation against the original release
+#
+#   Usage: python benchmarks/benchmark.py [-o results.json] [--compare baseline.json] [--quick]
+#   Timings are absolute, compare only against a baseline recorded on the same machine
+#   (run with -o on the commit to compare against). Needs the PySide6 version of requirements.txt
+# ------------------------------
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "morphometrix"))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+from geometry import BezierCurve, SplineCurve
+from measurement import Measurement, consts, measurement_records
+from batch import build_stack
+
+DEMO_IMAGE = os.path.join(ROOT, "demo", "demo-annotated.png")
+DEMO_CSV = os.path.join(ROOT, "demo", "demo-annotated.csv")
+
+CURVE_DEGREES = [2, 5, 10, 20, 30, 40]
+SPLINE_POINTS = [10, 100, 1000]
+WIDTH_COUNTS = [10, 25, 50, 100, 200]
+POLYGON_VERTICES = [10, 100, 1000, 5000]
+SCENE_SIZES = [1, 10, 50, 100]
+
+# Reference annotation of the demo image, run through the batch code path
+# REFERENCE_FILE holds its values measured by the original release (baseline_reference.py)
+# Spline fits have no counterpart there and are not part of it
+REFERENCE_ANNOTATION = {
+    "image_size": [1423, 921],
+    "measurements": [
+        {"type": "length", "name": "TL", "fit": "bezier", "points": [[228, 492], [500, 470], [800, 480], [1100, 500]]},
+        {"type": "length", "name": "fluke", "fit": "piecewise", "points": [[1100, 440], [1070, 495], [1100, 555]]},
+        {"type": "area", "name": "area", "points": [[600, 300], [700, 300], [700, 380], [600, 380], [640, 250]]},
+        {"type": "angle", "name": "fluke_angle", "points": [[1100, 440], [1040, 495], [1100, 555]]},
+    ],
+}
+REFERENCE_HANDLES = [400, 560]     # Image rows of side A and side B handles, above and below every station
+REFERENCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference.json")
+REFERENCE_TOLERANCE = 1e-6         # Pixels (degrees for angles), csv files are written to 0.01
+
+# Run fn repeatedly for about budget seconds, returns timings in seconds
+def timeit(fn, setup = None, budget = 0.2, min_runs = 3, max_runs = 50):
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < min_runs or (len(timings) < max_runs and time.perf_counter() - start < budget):
+        args = setup() if setup else ()
+        t = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - t)
+    return timings
+
+# Peak Python heap allocation (KiB) of one call, Qt allocations are not seen by tracemalloc
+def peak_memory(fn, setup = None):
+    args = setup() if setup else ()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+def record(results, case, fn, setup = None, budget = 0.2):
+    timings = timeit(fn, setup, budget)
+    results[case] = {"median_s": float(np.median(timings)), "min_s": float(np.min(timings)),
+                     "runs": len(timings), "peak_kib": peak_memory(fn, setup)}
+    print("%-36s %10.3f ms  %10.1f KiB" % (case, results[case]["median_s"]*1e3, results[case]["peak_kib"]))
+
+# Smooth control points of a curve with k+1 points across the demo image
+def control_points(k):
+    x = np.linspace(150, 1250, k + 1)
+    return np.column_stack((x, 460 + 40*np.sin(x/200)))
+
+# Star shaped outline with n vertices, traced as area clicks (never self intersecting)
+def outline(n):
+    a = np.linspace(0, 2*np.pi, n, endpoint = False)
+    r = 300 + 60*np.sin(7*a)
+    return np.column_stack((700 + r*np.cos(a), 460 + r*np.sin(a)))
+
+# ------------------------------
+#   Kernels (no Qt)
+# ------------------------------
+def bench_kernels(results, quick):
+    t = np.linspace(0, 1, 1000)
+    stations = np.linspace(0, 1, 102)[1:-1]     # 100 width stations
+    for k in CURVE_DEGREES:
+        P = control_points(k)
+        curve = BezierCurve(P)
+        record(results, "bezier_fit/degree=%d" % k, lambda: BezierCurve(P))    # Coefficients and total arc length
+        record(results, "bezier_evaluate/degree=%d" % k, lambda: curve.evaluate(t))     # Drawn polyline
+        record(results, "bezier_arc_length/degree=%d" % k, lambda: curve.arc_length(t))
+        # Fresh curve every run, stations include building its arc length table
+        record(results, "bezier_stations/degree=%d" % k, lambda c: c.inverse_arc_length(stations*c.length), lambda: (BezierCurve(P),))
+
+    for n in SPLINE_POINTS:
+        P = control_points(n - 1)
+        curve = SplineCurve(P)
+        record(results, "spline_fit/points=%d" % n, lambda: SplineCurve(P))
+        record(results, "spline_evaluate/points=%d" % n, lambda: curve.evaluate(t))
+        record(results, "spline_stations/points=%d" % n, lambda c: c.inverse_arc_length(stations*c.length), lambda: (SplineCurve(P),))
+
+    for n in POLYGON_VERTICES:
+        if quick and n > 1000:
+            continue
+        V = outline(n)
+        # Every click tests the cursor line against placed lines, as mousePressEvent does
+        def trace():
+            m = Measurement(consts.AREA, "area")
+            for x, y in V:
+                m.intersect_polygon((x, y))
+                m.add_point(x, y)
+            polygon = m.intersect_polygon(V[1] + (V[1] - V[0])*0.5 + (V[0] - V[-1])*0.5)
+            m.close_polygon(polygon if polygon is not None else m.points.array.copy())
+        record(results, "area_trace/vertices=%d" % n, trace, budget = 0.5)
+
+# ------------------------------
+#   Scene operations (offscreen Qt)
+# ------------------------------
+def bench_scene(results, quick):
+    import importlib.util
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    spec = importlib.util.spec_from_file_location("morphometrix_main", os.path.join(ROOT, "morphometrix", "__main__.py"))
+    main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main)
+    window = main.MainWindow()
+    window.resize(1400, 1000)
+    window.show()
+    iw = window.iw
+    iw.new_project(DEMO_IMAGE)
+    app.processEvents()
+
+    def add_length(name, k = 4):
+        iw.push_stack(name, consts.LENGTH)
+        for x, y in control_points(k):
+            iw.measurement_stack[-1].add_point(x, y)
+        iw.measurement_stack[-1].fit_curve()
+        iw.measuring_state = None
+
+    for n in WIDTH_COUNTS:
+        if quick and n > 50:
+            continue
+        def setup():
+            iw.new_project(DEMO_IMAGE)
+            add_length("TL")
+            iw.draw_scene()
+            window.subWin.numwidths.setText(str(n + 1))     # Segments, one more than stations
+            return ()
+        record(results, "measure_widths/widths=%d" % n, iw.measure_widths, setup)
+
+    for n in SCENE_SIZES:
+        if quick and n > 10:
+            continue
+        def setup():
+            iw.new_project(DEMO_IMAGE)
+            for i in range(n):
+                match i % 3:
+                    case 0:
+                        add_length("L%d" % i)
+                    case 1:
+                        iw.push_stack("A%d" % i, consts.AREA)
+                        for x, y in outline(12) + i:
+                            iw.measurement_stack[-1].add_point(x, y)
+                        iw.measurement_stack[-1].close_polygon(iw.measurement_stack[-1].points.array.copy())
+                    case 2:
+                        iw.push_stack("G%d" % i, consts.ANGLE)
+                        for x, y in [(300, 700), (400, 700), (380, 600 - i)]:
+                            iw.measurement_stack[-1].add_point(x, y)
+                        iw.measurement_stack[-1].calculate_angle()
+                iw.measuring_state = None
+            return ()
+        def paint():
+            iw.draw_scene()
+            iw.viewport().repaint()
+        record(results, "draw_scene/measurements=%d" % n, paint, setup)
+        record(results, "draw_scene_unchanged/measurements=%d" % n, paint)   # Layers already in sync
+
+    window.close()
+    window.deleteLater()    # Delete Qt objects before interpreter shutdown
+    app.processEvents()
+
+# ------------------------------
+#   Numeric checks
+# ------------------------------
+# Unit conversion only: meter rows of demo csv recomputed from its pixel rows, within the csv's rounding
+# The csv holds no control points, so no geometry is checked here
+def check_demo_units():
+    with open(DEMO_CSV, newline = '') as f:
+        rows = list(csv.reader(f))
+    meta = {row[0]: row[1] for row in rows[1:8]}
+    m = float(meta["Pixel Dimension"]) * (float(meta["Altitude"]) / float(meta["Focal Length"]))
+    values = rows[8:]
+    unit_rows, pixel_rows = values[:len(values)//2], values[len(values)//2:]
+
+    stack = []
+    for (name, value, unit), (_, pixels, _) in zip(unit_rows, pixel_rows):
+        measurement = Measurement({"Meters": consts.LENGTH, "Square Meters": consts.AREA, "Degrees": consts.ANGLE}[unit], name)
+        measurement.measurement_value = float(pixels)
+        stack.append(measurement)
+
+    failures = []
+    for (name, expected, unit), (_, _, _, _, value, _) in zip(unit_rows, measurement_records(stack, m)):
+        decimals = len(expected.split(".")[1]) if "." in expected else 0
+        pixel_error = 0.05 * {"Meters": m, "Square Meters": m*m, "Degrees": 1}[unit]     # Csv pixels are rounded to 0.1
+        if abs(value - float(expected)) > 0.5*10**-decimals + pixel_error:
+            failures.append("%s: %.6f != %s" % (name, value, expected))
+    return failures
+
+# Full precision values of the reference annotation
+def reference_values():
+    stack = build_stack(REFERENCE_ANNOTATION, REFERENCE_ANNOTATION["image_size"])
+    length = stack[0]
+    width = Measurement(consts.WIDTH, "TL")
+    width.place_widths(length, 9, *REFERENCE_ANNOTATION["image_size"], 0)
+    width.handles[:,:,0] = width.centers[:,None,0]
+    width.handles[:,:,1] = REFERENCE_HANDLES
+    width.calculate_widths("Side A")    # Distance from station, depends on curve stations
+    stack.insert(1, width)
+    return {"%s/%s/%s" % (type_name, name, "" if station is None else "%.1f" % station): pixels
+            for name, type_name, station, pixels, value, unit in measurement_records(stack, 1.0)}
+
+# Reference annotation measured by this tree against the original release
+def check_reference():
+    values = reference_values()
+    with open(REFERENCE_FILE) as f:
+        expected = json.load(f)["values"]
+    failures = ["%s missing" % key for key in expected if key not in values]
+    for key, value in values.items():
+        if key not in expected:
+            failures.append("%s not in reference" % key)
+        elif abs(value - expected[key]) > REFERENCE_TOLERANCE:
+            failures.append("%s: %r != %r" % (key, value, expected[key]))
+    return failures
+
+# Interpreter, library versions and machine the timings were taken on
+def environment():
+    import PySide6
+    return {"python": platform.python_version(), "numpy": np.__version__, "pyside6": PySide6.__version__,
+            "machine": platform.machine(), "processor": platform.processor(), "host": platform.node(), "cpus": os.cpu_count()}
+
+# Cases more than threshold times slower than in baseline, best runs are compared as they vary least
+def compare(results, baseline, threshold):
+    slower = []
+    for case, result in results.items():
+        if case in baseline["results"]:
+            ratio = result["min_s"] / baseline["results"][case]["min_s"]
+            if ratio > threshold:
+                slower.append("%s: %.2fx slower" % (case, ratio))
+    return slower
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "MorphoMetrix benchmarks")
+    parser.add_argument("-o", "--output", default = None, help = "Write timings and peak memory to JSON file")
+    parser.add_argument("--compare", default = None, help = "Baseline JSON to compare timings with")
+    parser.add_argument("--threshold", type = float, default = 1.5, help = "Slowdown ratio reported as regression")
+    parser.add_argument("--quick", action = "store_true", help = "Skip largest cases")
+    args = parser.parse_args(argv)
+
+    results = {}
+    bench_kernels(results, args.quick)
+    bench_scene(results, args.quick)
+
+    checks = {"demo_units": check_demo_units(), "reference": check_reference()}
+    for name, failures in checks.items():
+        print("check %-10s %s" % (name, "ok" if not failures else "FAILED"))
+        for failure in failures:
+            print("    " + failure)
+
+    if args.output:
+        report = {"date": str(date.today()), **environment(), "results": results, "checks": checks}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 1)
+
+    slower = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        differs = [key for key, value in environment().items() if baseline.get(key) != value]
+        if differs:     # Ratios mean little across machines
+            print("warning: baseline recorded with different %s, record one on this machine with -o" % ", ".join(differs))
+        slower = compare(results, baseline, args.threshold)
+        for line in slower:
+            print("regression " + line)
+    return 1 if slower or any(checks.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
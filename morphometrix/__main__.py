@@ -1,12 +1,20 @@
 #usr/bin/env python
-import os, sys, csv, traceback, platform, types
+import time
+STARTED = time.perf_counter()   # Startup phases (--profile-startup) are timed from here
+import os, sys, csv, traceback, platform, types, threading
 from datetime import date
 import numpy as np
-import webbrowser
+from geometry import warm_up
 from graphicsview import imwin, resource_path
+from measurement import metadata_rows
+from project import save_project, load_project, PROJECT_EXTENSION
+from imagequeue import ImageQueue
+from imageexport import ImageExporter, EXPORT_FORMATS
+from metadata import MetadataIndex
+from instrumentation import profiler, timed, PROFILE_VARIABLE
 
 from PySide6 import QtGui, QtCore
-from PySide6.QtWidgets import QSlider ,QColorDialog ,QComboBox, QMainWindow, QApplication,  QWidget, QToolBar, QPushButton, QLabel, QLineEdit, QPlainTextEdit, QGridLayout, QFileDialog, QMessageBox, QInputDialog, QDockWidget, QSizePolicy, QRadioButton
+from PySide6.QtWidgets import QSlider ,QColorDialog ,QComboBox, QMainWindow, QApplication,  QWidget, QToolBar, QPushButton, QLabel, QLineEdit, QPlainTextEdit, QGridLayout, QFileDialog, QMessageBox, QInputDialog, QDockWidget, QSizePolicy, QRadioButton, QCheckBox
 from PySide6.QtGui import QShortcut, QIcon, QIntValidator, QDoubleValidator
 from PySide6.QtCore import Qt
 
@@ -70,6 +78,10 @@ class Window(QWidget):
         self.numwidths.setValidator(QIntValidator())
         self.numwidths.setText('10')
 
+        self.label_snap = QLabel("Snap Widths to Edges:")
+        self.snap_widths = QCheckBox()      # Propose width handles at strongest image edge
+        self.snap_widths.setChecked(False)
+
         self.label_side = QLabel("Mirror Side:")
         self.side_bias = QComboBox()
         self.side_bias.addItems(["None","Side A", "Side B"])
@@ -98,8 +110,27 @@ class Window(QWidget):
         self.button_color.setStyleSheet("background-color: red")
         self.button_color.clicked.connect(self.color_changed)
 
+        self.label_export = QLabel("Image Export Format:")
+        self.export_format = QComboBox()
+        self.export_format.addItems(list(EXPORT_FORMATS))
+
+        self.label_export_scale = QLabel("Image Export Scale:")
+        self.export_scale = QLineEdit()
+        self.export_scale.setValidator(QDoubleValidator())
+        self.export_scale.setText('1.0')   # Native image resolution
+
+        self.label_quality = QLabel("Image Export Quality (0-100):")
+        self.export_quality = QLineEdit()
+        self.export_quality.setValidator(QIntValidator(0, 100))
+        self.export_quality.setText('90')
+
+        self.label_results = QLabel("Results Store:")
+        self.button_results = QPushButton("None (csv per image)")
+        self.button_results.clicked.connect(self.results_changed)
+        self.results_path = None    # SQLite file exports are appended to, None writes a csv per image
+
         self.manual = QPushButton("Manual", self)
-        self.manual.clicked.connect(lambda: webbrowser.open('https://github.com/ZappyMan/MorphoMetriX/blob/master/MorphoMetriX_v2_manual.pdf'))
+        self.manual.clicked.connect(self.open_manual)
 
         self.exit = QPushButton("Exit", self)
         self.exit.clicked.connect(self.close_application)
@@ -127,10 +158,25 @@ class Window(QWidget):
         self.grid.addWidget(self.notes, 10, 1)
         self.grid.addWidget(self.label_color,11,0)
         self.grid.addWidget(self.button_color,11,1)
-        self.grid.addWidget(self.manual, 12, 1)
-        self.grid.addWidget(self.exit, 13, 1)
+        self.grid.addWidget(self.label_export,12,0)
+        self.grid.addWidget(self.export_format,12,1)
+        self.grid.addWidget(self.label_export_scale,13,0)
+        self.grid.addWidget(self.export_scale,13,1)
+        self.grid.addWidget(self.label_quality,14,0)
+        self.grid.addWidget(self.export_quality,14,1)
+        self.grid.addWidget(self.label_results,15,0)
+        self.grid.addWidget(self.button_results,15,1)
+        self.grid.addWidget(self.label_snap,16,0)
+        self.grid.addWidget(self.snap_widths,16,1)
+        self.grid.addWidget(self.manual, 17, 1)
+        self.grid.addWidget(self.exit, 18, 1)
         self.setLayout(self.grid)
 
+    # Open manual in browser, webbrowser is imported on first use
+    def open_manual(self):
+        import webbrowser
+        webbrowser.open('https://github.com/ZappyMan/MorphoMetriX/blob/master/MorphoMetriX_v2_manual.pdf')
+
     # Function used by color picker button
     # Waits for user color selection, then passes color to imwin function "picked_color"
     def color_changed(self):
@@ -138,6 +184,14 @@ class Window(QWidget):
         self.button_color.setStyleSheet("background-color: "+color.name())
         self.iw.picked_color = color
 
+    # Function used by results store button
+    # Selects (or creates) SQLite file that exports are appended to, cancel goes back to csv files
+    def results_changed(self):
+        name = QFileDialog.getSaveFileName(self, 'Results Store', filter="SQLite (*.sqlite)",
+                                           options=QFileDialog.Option.DontConfirmOverwrite)[0]
+        self.results_path = name or None
+        self.button_results.setText(os.path.basename(name) if name else "None (csv per image)")
+
     # Function called when "crosshair size" slider value changes
     # Passed new size to imwin function "slider_moved"
     def slider_changed(self):
@@ -152,7 +206,7 @@ class Window(QWidget):
         if choice == QMessageBox.StandardButton.Yes:
             # self.parent().deleteLater()
             # self.parent().close()
-            sys.exit()
+            QApplication.exit()     # Image queue and exporter finish their background work on aboutToQuit
 
 #references:
 #https://stackoverflow.com/questions/26901540/arc-in-qgraphicsscene/26903599#26903599
@@ -194,6 +248,33 @@ class MainWindow(QMainWindow):
         self.importImage = QPushButton("New Image", self)
         self.importImage.clicked.connect(self.file_open)
 
+        self.openFolder = QPushButton("Open Folder", self)
+        self.openFolder.clicked.connect(self.folder_open)
+
+        self.exporter = ImageExporter()     # Annotated image export, encoded in background
+        self.exporter.finished.connect(self.export_finished)
+
+        self.metadata_indexes = {}  # Folder -> MetadataIndex of camera metadata
+
+        self.queue = ImageQueue()   # Images of opened folder, decoded in background
+        self.queue.ready.connect(self.show_queued_image)
+        self.queue.failed.connect(lambda path, error: self.statusbar.showMessage('Could not open ' + os.path.basename(path) + ': ' + error))
+
+        shortcut_next = QShortcut(QtGui.QKeySequence(QtCore.Qt.Key.Key_PageDown), self)
+        shortcut_next.activated.connect(lambda: self.step_image(1))
+        shortcut_previous = QShortcut(QtGui.QKeySequence(QtCore.Qt.Key.Key_PageUp), self)
+        shortcut_previous.activated.connect(lambda: self.step_image(-1))
+
+        self.openProject = QPushButton("Open Project", self)
+        self.openProject.clicked.connect(self.project_open)
+
+        self.saveProject = QPushButton("Save Project", self)
+        self.saveProject.clicked.connect(self.project_save)
+        self.saveProject.setEnabled(False)
+
+        shortcut_save = QShortcut(QtGui.QKeySequence('Ctrl+S'), self)
+        shortcut_save.activated.connect(self.project_save)
+
         self.lengthButton = QPushButton("Measure Length", self)
         self.lengthButton.clicked.connect(self.measure_length)
         self.lengthButton.setEnabled(False)
@@ -227,39 +308,196 @@ class MainWindow(QMainWindow):
         shortcut_undo = QShortcut(QtGui.QKeySequence('Ctrl+Z'), self)
         shortcut_undo.activated.connect(self.undo)
 
+        self.redoButton = QPushButton("Redo", self)
+        self.redoButton.clicked.connect(self.redo)
+        self.redoButton.setEnabled(False)
+
+        for key in ('Ctrl+Shift+Z', 'Ctrl+Y'):
+            shortcut_redo = QShortcut(QtGui.QKeySequence(key), self)
+            shortcut_redo.activated.connect(self.redo)
+
         self.bezier = QRadioButton("Bezier fit", self)
         self.bezier.setEnabled(True)
         self.bezier.setChecked(True)
 
         self.piecewise = QRadioButton("Piecewise", self)
 
+        self.spline = QRadioButton("Spline", self)
+
         self.statusbar = self.statusBar()
         self.statusbar.showMessage('Select new image to begin')
 
+        # Handler latencies p50/p95/max (ms) and scene item count, shown while profiling
+        self.profileLabel = QLabel(self)
+        self.statusbar.addPermanentWidget(self.profileLabel)
+        self.profileTimer = QtCore.QTimer(self)
+        self.profileTimer.timeout.connect(self.update_profile)
+        self.set_profiling(profiler.enabled)
+
+        shortcut_profile = QShortcut(QtGui.QKeySequence('Ctrl+Shift+P'), self)
+        shortcut_profile.activated.connect(lambda: self.set_profiling(not profiler.enabled))
+        shortcut_trace = QShortcut(QtGui.QKeySequence('Ctrl+Shift+T'), self)
+        shortcut_trace.activated.connect(self.save_trace)
+
         self.tb = QToolBar('Toolbar')
         spacer = QWidget(self)
         spacer.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.tb.addWidget(spacer)
         self.addToolBar(self.tb)
         self.tb.addWidget(self.importImage)
+        self.tb.addWidget(self.openFolder)
+        self.tb.addWidget(self.openProject)
+        self.tb.addWidget(self.saveProject)
         self.tb.addWidget(self.exportButton)
         self.tb.addWidget(self.lengthButton)
         self.tb.addWidget(self.widthsButton)
         self.tb.addWidget(self.areaButton)
         self.tb.addWidget(self.angleButton)
         self.tb.addWidget(self.undoButton)
+        self.tb.addWidget(self.redoButton)
         self.tb.addWidget(self.bezier)
         self.tb.addWidget(self.piecewise)
+        self.tb.addWidget(self.spline)
 
     # New Project
     # Set all defaults and clear stored values
     def file_open(self):
-        self.image_name = QFileDialog.getOpenFileName(self, 'Open File', filter="Images (*.png *.jpg *.PNG *.JPG)")
-
-        if self.image_name[0]: # If user selected a file, create new project
-            self.iw.new_project(self.image_name[0])
-            self.statusbar.showMessage('Select a measurement to make from the toolbar')
+        image_name = QFileDialog.getOpenFileName(self, 'Open File', filter="Images (*.png *.jpg *.PNG *.JPG)")
+
+        if image_name[0]: # If user selected a file, create new project
+            try:
+                self.iw.new_project(image_name[0])
+            except IOError as e:    # Current project is kept
+                QMessageBox.warning(self,"Warning","Could not open image: " + str(e),QMessageBox.StandardButton.Ok)
+                return
+            self.queue.close()      # Leave folder session, a decode still running must not replace this image
+            self.image_name = image_name
+            self.statusbar.showMessage('Select a measurement to make from the toolbar' + self.fill_metadata(self.image_name[0]))
             self.enable_all_measurements()
+            self.saveProject.setEnabled(True)
+
+    # Folder session, PageDown/PageUp step through images of folder
+    def folder_open(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Open Folder')
+        if folder:
+            if self.queue.open(folder):
+                self.metadata_indexes[folder] = MetadataIndex(folder)
+                self.metadata_indexes[folder].scan_in_background(self.queue.paths)  # Index whole folder once
+                self.queue.show(0)
+            else:
+                self.statusbar.showMessage('No images in ' + folder)
+
+    # Move to next (1) or previous (-1) image of folder session
+    def step_image(self, delta):
+        if len(self.queue) and not self.queue.step(delta):
+            self.statusbar.showMessage('Last image of folder' if delta > 0 else 'First image of folder')
+
+    # Called by image queue once current image is decoded
+    def show_queued_image(self, path, pyramid):
+        self.image_name = (path, "")
+        self.iw.new_project(path, pyramid)
+        self.enable_all_measurements()
+        self.saveProject.setEnabled(True)
+        self.statusbar.showMessage('Image %d of %d: %s' % (self.queue.index + 1, len(self.queue), os.path.basename(path)) + self.fill_metadata(path))
+
+    # Fill focal length, altitude and pixel dimension from image EXIF/XMP where present
+    # Returns note for status bar of the fields filled
+    def fill_metadata(self, path):
+        folder = os.path.dirname(path)
+        if folder not in self.metadata_indexes:
+            self.metadata_indexes[folder] = MetadataIndex(folder)
+        metadata = self.metadata_indexes[folder].get(path)
+        fields = {"focal_length": self.subWin.focal, "altitude": self.subWin.altitude, "pixel_dimension": self.subWin.pixeldim}
+        filled = [key for key in fields if key in metadata]
+        for key in filled:
+            fields[key].setText("{0:g}".format(metadata[key]))
+        return " (from image metadata: " + ", ".join(key.replace("_", " ") for key in filled) + ")" if filled else ""
+
+    # Start or stop timing of GUI handlers (also started by environment variable MORPHOMETRIX_PROFILE=1)
+    def set_profiling(self, enabled):
+        profiler.enabled = enabled
+        self.profileLabel.setVisible(enabled)
+        if enabled:
+            self.profileTimer.start(500)
+            self.update_profile()
+        else:
+            self.profileTimer.stop()
+
+    # Refresh latency summary in status bar
+    def update_profile(self):
+        self.profileLabel.setText('%d measurements, %d items | %s | p50/p95/max ms: %s' % (
+            len(self.iw.measurement_stack), len(self.iw.scene.items()), self.iw.scheduler.summary(), profiler.summary() or 'no events yet'))
+
+    # Write handler timings of session as Chrome trace JSON, to attach to bug reports
+    def save_trace(self):
+        if not profiler.trace:
+            self.statusbar.showMessage('No trace recorded, start profiling with Ctrl+Shift+P or ' + PROFILE_VARIABLE + '=1')
+            return
+        name = QFileDialog.getSaveFileName(self, 'Save Trace', 'morphometrix-trace.json', filter="Chrome Trace (*.json)")[0]
+        if name:
+            n = profiler.write_trace(name, {"version": VERSION, "system": platform.system(), "python": platform.python_version(),
+                                            "image": getattr(self, "image_name", ("",))[0]})
+            self.statusbar.showMessage('Trace of %d events saved' % n)
+
+    # Save measurements, control points and metadata of current image to project file
+    def project_save(self):
+        if not self.saveProject.isEnabled():
+            return
+        name = QFileDialog.getSaveFileName(
+            self, 'Save Project', self.image_name[0].split('.', 1)[0] + PROJECT_EXTENSION, filter="MorphoMetriX Project (*" + PROJECT_EXTENSION + ")")[0]
+        if name:
+            if not name.endswith(PROJECT_EXTENSION):
+                name += PROJECT_EXTENSION
+            metadata = {"image_path": self.image_name[0],
+                        "image_id": self.subWin.id.text(),
+                        "focal_length": self.subWin.focal.text(),
+                        "altitude": self.subWin.altitude.text(),
+                        "pixel_dimension": self.subWin.pixeldim.text(),
+                        "width_segments": self.subWin.numwidths.text(),
+                        "mirror_side": self.subWin.side_bias.currentText(),
+                        "notes": self.subWin.notes.toPlainText(),
+                        "measuring_state": self.iw.measuring_state}
+            save_project(name, self.iw.measurement_stack, metadata)
+            self.statusbar.showMessage('Project saved')
+
+    # Restore image, measurements and metadata from project file
+    def project_open(self):
+        name = QFileDialog.getOpenFileName(self, 'Open Project', filter="MorphoMetriX Project (*" + PROJECT_EXTENSION + ")")[0]
+        if not name:
+            return
+        try:
+            measurement_stack, metadata = load_project(name)
+        except Exception as e:
+            QMessageBox.warning(self,"Warning","Could not open project: " + str(e),QMessageBox.StandardButton.Ok)
+            return
+
+        image_path = metadata["image_path"]
+        if not os.path.exists(image_path):     # Image moved since project was saved
+            QMessageBox.information(self,"Locate Image","Image not found, select "+os.path.basename(image_path),QMessageBox.StandardButton.Ok)
+            image_path = QFileDialog.getOpenFileName(self, 'Open File', filter="Images (*.png *.jpg *.PNG *.JPG)")[0]
+            if not image_path:
+                return
+
+        try:
+            self.iw.new_project(image_path)
+        except IOError as e:
+            QMessageBox.warning(self,"Warning","Could not open image: " + str(e),QMessageBox.StandardButton.Ok)
+            return
+        self.queue.close()      # Leave folder session
+
+        self.image_name = (image_path, "")
+        self.subWin.id.setText(metadata["image_id"])
+        self.subWin.focal.setText(metadata["focal_length"])
+        self.subWin.altitude.setText(metadata["altitude"])
+        self.subWin.pixeldim.setText(metadata["pixel_dimension"])
+        self.subWin.numwidths.setText(metadata["width_segments"])
+        self.subWin.side_bias.setCurrentText(metadata["mirror_side"])
+        self.subWin.notes.setPlainText(metadata["notes"])
+
+        self.enable_all_measurements()
+        self.saveProject.setEnabled(True)
+        self.iw.load_measurements(measurement_stack, metadata["measuring_state"])
+        self.statusbar.showMessage('Project loaded')
     
     # Enable all measurement buttons
     def enable_all_measurements(self):
@@ -308,6 +546,14 @@ class MainWindow(QMainWindow):
     def disable_undo(self):
         self.undoButton.setEnabled(False)
 
+    # Enable redo button
+    def enable_redo(self):
+        self.redoButton.setEnabled(True)
+
+    # Disable redo button
+    def disable_redo(self):
+        self.redoButton.setEnabled(False)
+
     # Enable export button
     def enable_export(self):
         self.exportButton.setEnabled(True)
@@ -344,9 +590,14 @@ class MainWindow(QMainWindow):
     # Call undo function within graphicsview class
     def undo(self):
         self.iw.undo()
+
+    # Call redo function within graphicsview class
+    def redo(self):
+        self.iw.redo()
         
     # Export measurements to csv
     # Collect measurements from graphicsview
+    @timed("export_measurements")
     def export_measurements(self):
         # Popup to get user save file input
         
@@ -362,33 +613,44 @@ class MainWindow(QMainWindow):
             self, 'Save File', self.image_name[0].split('.', 1)[0])[0]
 
         if name:
-            meta_data = [["Object","Value","Value_unit"],
-                        ['Image ID',self.subWin.id.text(),"Metadata"],
-                        ['Image Path',self.image_name[0],"Metadata"],
-                        ['Focal Length', focal,"Metadata"],
-                        ['Altitude', altitude,"Metadata"],
-                        ['Pixel Dimension', pixeldim,"Metadata"],
-                        ['Mirror Side', self.subWin.side_bias.currentText(), "Metadata"],
-                        ['Notes', self.subWin.notes.toPlainText(), "Metadata"]]
-
-	        #Write .csv file
-            with open(name + '.csv', 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-
-                writer.writerows(meta_data)     # Writes flight data and metadata
-
-                self.iw.calculate_widths(self.subWin.side_bias.currentText())      # Calculate widths of MovingEllipses at export
-                m = pixeldim * (altitude / focal)
-                pixel_measurements, unit_measurements = self.iw.get_measurement_names_and_values(m)
-                
-                writer.writerows(unit_measurements)
-                writer.writerows(pixel_measurements)
-
-            #Export image
-            self.iw.fitInView(self.iw.scene.sceneRect(), QtCore.Qt.AspectRatioMode.KeepAspectRatio)
-            pix = QtGui.QPixmap(self.iw.viewport().size())
-            self.iw.viewport().render(pix)
-            pix.save(name + '-measurements.png')
+            meta_data = metadata_rows(self.subWin.id.text(), self.image_name[0], focal, altitude, pixeldim,
+                                      self.subWin.side_bias.currentText(), self.subWin.notes.toPlainText())
+
+            self.iw.calculate_widths(self.subWin.side_bias.currentText())      # Calculate widths of MovingEllipses at export
+
+            if self.subWin.results_path:
+                #Append to results store instead of writing a .csv file
+                from results import append_results     # sqlite3 is only loaded once a store is used
+                append_results(self.subWin.results_path, self.iw.measurement_stack, self.subWin.id.text(), self.image_name[0],
+                               focal, altitude, pixeldim, self.subWin.side_bias.currentText(), self.subWin.notes.toPlainText())
+            else:
+                #Write .csv file
+                with open(name + '.csv', 'w', newline='') as csvfile:
+                    writer = csv.writer(csvfile)
+
+                    writer.writerows(meta_data)     # Writes flight data and metadata
+
+                    m = pixeldim * (altitude / focal)
+                    pixel_measurements, unit_measurements = self.iw.get_measurement_names_and_values(m)
+                    
+                    writer.writerows(unit_measurements)
+                    writer.writerows(pixel_measurements)
+
+            #Export image at image resolution, view is left as is
+            try:
+                scale = float(self.subWin.export_scale.text())
+                quality = int(self.subWin.export_quality.text())
+            except ValueError:
+                scale, quality = 1.0, 90
+            extension = EXPORT_FORMATS[self.subWin.export_format.currentText()]
+            self.exporter.export(self.iw, name + '-measurements.' + extension, max(scale, 0.01), quality)
+            self.statusbar.showMessage('Exporting image...')
+
+    # Called once annotated image is written
+    def export_finished(self, path, error):
+        if error:
+            QMessageBox.warning(self,"Warning","Could not export image: " + error,QMessageBox.StandardButton.Ok)
+        else:
             self.statusbar.showMessage('Export Complete!')
 
 # Crash handler for error logging
@@ -421,11 +683,47 @@ def except_hook(exc_type, exc_value, exc_tb):
     QApplication.quit() # Quit application
 
 
+# Print time of startup phase since this module began importing (--profile-startup)
+def startup_mark(phase, start = None):
+    now = time.perf_counter()
+    print("startup %-24s %8.1f ms" % (phase, (now - STARTED)*1e3), file=sys.stderr, flush=True)
+    if profiler.enabled:    # Also in session trace
+        profiler.record("startup/" + phase, STARTED if start is None else start, now)
+
+# Marks first paint of watched widget (--profile-startup)
+class FirstPaint(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Type.Paint:
+            obj.removeEventFilter(self)
+            QtCore.QTimer.singleShot(0, lambda: startup_mark("first paint"))   # Once paint is done
+        return False
+
+# Import numeric dependencies off the GUI thread, so the first curve fit does not wait for them
+def background_warm_up(profile_startup):
+    start = time.perf_counter()
+    warm_up()
+    if profile_startup:
+        startup_mark("warm-up (background)", start)
+
 def main():
+    import multiprocessing
+    multiprocessing.freeze_support()    # Frozen (PyInstaller) batch workers run as workers, not as main()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":   # Headless batch measurement, no QApplication
+        import batch
+        sys.exit(batch.main(sys.argv[2:]))
+    profile_startup = "--profile-startup" in sys.argv
+    if profile_startup:
+        sys.argv.remove("--profile-startup")
+        startup_mark("imports")
     sys.excepthook = except_hook
     app = QApplication(sys.argv)
     main = MainWindow()
+    if profile_startup:
+        startup_mark("window")
+        first_paint = FirstPaint(main)
+        main.iw.viewport().installEventFilter(first_paint)
     main.show()
+    threading.Thread(target = background_warm_up, args = (profile_startup,), daemon = True).start()
     app.exec()
     sys.exit()
 
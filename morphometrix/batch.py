@@ -0,0 +1,198 @@
+import os, sys, csv, json, argparse
+from concurrent.futures import ProcessPoolExecutor
+from measurement import Measurement, consts, metadata_rows, measurement_rows
+from results import result_rows, append_rows
+from metadata import image_size
+
+# ------------------------------
+#   MorphoMetrix Batch Measurement
+#   Computes measurements of many images from annotation files, without Qt
+#   Writes the same csv layout as MainWindow.export_measurements
+#
+#   Usage: morphometrix batch ANNOTATIONS... -o OUTPUT_DIR [options]
+#
+#   JSON annotation: one image record, or a list of records
+#       {"image": "frame.png", "image_id": "0000", "focal_length": 25, "altitude": 50,
+#        "pixel_dimension": 0.0045, "mirror_side": "None", "notes": "", "image_size": [w, h],
+#        "measurements": [
+#           {"type": "length", "name": "TL", "fit": "bezier", "points": [[x, y], ...]},
+#           {"type": "width", "name": "TL", "handles": [[[ax, ay], [bx, by]], ...]},
+#           {"type": "area", "name": "area", "points": [[x, y], ...]},
+#           {"type": "angle", "name": "fluke_angle", "points": [[x, y], [x, y], [x, y]]}]}
+#   Missing metadata falls back to the command line options
+#   Length fit is "bezier", "spline" or "piecewise", points are the curve control points
+#   Widths measure the length placed before them, one side A/B handle pair per station
+#   Area points are closed where the outline crosses itself, as in the GUI, or else at the last point
+#
+#   CSV annotation: header image,name,type,x,y (optional fit column), one point per row
+#   Width rows alternate side A and side B handles of consecutive stations
+#
+#   Each image record is written to OUTPUT_DIR/<image name>.csv, records whose names clash
+#   (same image annotated twice, same frame name in different folders) get _2, _3, ... in order given
+#
+#   With --store, rows are appended to a SQLite results store (see results.py) instead of csv files
+# ------------------------------
+
+MEASUREMENT_TYPES = {"length": consts.LENGTH, "area": consts.AREA, "angle": consts.ANGLE, "width": consts.WIDTH}
+
+# Load image records from json or csv annotation file
+def read_annotations(path):
+    if path.lower().endswith('.json'):
+        with open(path) as f:
+            records = json.load(f)
+        if isinstance(records, dict):
+            records = [records]
+    else:
+        records = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                record = records.setdefault(row['image'], {"image": row['image'], "measurements": []})
+                measurements = record["measurements"]
+                # Consecutive rows of the same name and type make up one measurement
+                if not measurements or (measurements[-1]["name"], measurements[-1]["type"]) != (row['name'], row['type']):
+                    measurements.append({"name": row['name'], "type": row['type'], "fit": row.get('fit') or "bezier", "points": []})
+                measurements[-1]["points"].append([float(row['x']), float(row['y'])])
+        records = list(records.values())
+        for record in records:
+            for measurement in record["measurements"]:
+                if measurement["type"] == "width":
+                    P = measurement.pop("points")
+                    measurement["handles"] = [P[i:i+2] for i in range(0, len(P), 2)]
+    # Relative image paths are relative to annotation file
+    for record in records:
+        record["image"] = os.path.join(os.path.dirname(os.path.abspath(path)), record["image"])
+    return records
+
+# Replay annotation of one image into a measurement stack
+def build_stack(record, size):
+    stack = []
+    for annotation in record["measurements"]:
+        measurement = Measurement(MEASUREMENT_TYPES[annotation["type"]], annotation["name"])
+        match measurement.get_type():
+            case consts.LENGTH:
+                for x, y in annotation["points"]:
+                    measurement.add_point(x, y)
+                fit = annotation.get("fit", "bezier")
+                if fit == "piecewise":
+                    measurement.calculate_length()
+                else:
+                    measurement.fit_curve(spline = fit == "spline")
+            case consts.ANGLE:
+                for x, y in annotation["points"][:3]:
+                    measurement.add_point(x, y)
+                measurement.calculate_angle()
+            case consts.AREA:
+                for x, y in annotation["points"]:
+                    polygon = measurement.intersect_polygon((x, y))
+                    if polygon is not None:
+                        break
+                    measurement.add_point(x, y)
+                else:
+                    polygon = measurement.points.array.copy()
+                measurement.close_polygon(polygon)
+            case consts.WIDTH:
+                lengths = [m for m in stack if m.get_type() == consts.LENGTH]
+                if not lengths or lengths[-1].curve is None:
+                    raise ValueError("Width measurement '%s' needs a fitted length before it" % annotation["name"])
+                handles = annotation["handles"]
+                measurement.place_widths(lengths[-1], len(handles), size[0], size[1], 0)
+                if len(measurement.centers) != len(handles):
+                    raise ValueError("Width measurement '%s' has stations outside of image" % annotation["name"])
+                measurement.handles[:] = handles
+        stack.append(measurement)
+    return stack
+
+# Unique csv path in output directory for every record, numbered on name clashes
+def output_paths(records, output):
+    paths, used = [], set()
+    for record in records:
+        stem = os.path.splitext(os.path.basename(record["image"]))[0]
+        name, n = stem, 1
+        while name.lower() in used:     # Case insensitive file systems
+            n += 1
+            name = "%s_%d" % (stem, n)
+        used.add(name.lower())
+        paths.append(os.path.join(output, name + '.csv'))
+    return paths
+
+# Measure one image record and write its csv to path, returns csv path
+# Without csv path, returns results store rows instead
+def process_record(record, path, defaults):
+    record = {**defaults, **record}
+    size = record.get("image_size")
+    if size is None and any(a["type"] == "width" for a in record["measurements"]):
+        size = image_size(record["image"])
+    stack = build_stack(record, size)
+
+    pixeldim, altitude, focal = float(record["pixel_dimension"]), float(record["altitude"]), float(record["focal_length"])
+    for measurement in stack:
+        if measurement.get_type() == consts.WIDTH:
+            measurement.calculate_widths(record["mirror_side"])
+    if path is None:
+        return result_rows(stack, record["image_id"], record["image"], focal, altitude, pixeldim,
+                           record["mirror_side"], record["notes"])
+    m = pixeldim * (altitude / focal)
+    pixel_measurements, unit_measurements = measurement_rows(stack, m)
+
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerows(metadata_rows(record["image_id"], record["image"], focal, altitude, pixeldim,
+                                       record["mirror_side"], record["notes"]))
+        writer.writerows(unit_measurements)
+        writer.writerows(pixel_measurements)
+    return path
+
+# Worker entry point, errors are returned so one bad image does not stop the batch
+def process_task(task):
+    record, path, defaults = task
+    try:
+        return record["image"], process_record(record, path, defaults), None
+    except Exception as e:
+        return record["image"], None, "%s: %s" % (type(e).__name__, e)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "morphometrix batch", description = "Measure images from point annotations without the GUI")
+    parser.add_argument("annotations", nargs = "+", help = "JSON or CSV annotation files")
+    parser.add_argument("-o", "--output", default = ".", help = "Directory of exported csv files")
+    parser.add_argument("--store", default = None, help = "SQLite results store to append to, instead of csv files")
+    parser.add_argument("-j", "--jobs", type = int, default = None, help = "Worker processes (default: all cores)")
+    parser.add_argument("--image-id", default = "0000")
+    parser.add_argument("--focal", type = float, default = 25, help = "Focal Length (mm)")
+    parser.add_argument("--altitude", type = float, default = 50, help = "Altitude (m)")
+    parser.add_argument("--pixel-dim", type = float, default = 0.0045, help = "Pixel Dimension (mm/pixel)")
+    parser.add_argument("--side", default = "None", choices = ["None", "Side A", "Side B"], help = "Mirror Side")
+    parser.add_argument("--notes", default = "")
+    args = parser.parse_args(argv)
+
+    defaults = {"image_id": args.image_id, "focal_length": args.focal, "altitude": args.altitude,
+                "pixel_dimension": args.pixel_dim, "mirror_side": args.side, "notes": args.notes}
+    output = None if args.store else args.output
+    if output:
+        os.makedirs(output, exist_ok = True)
+    records = [record for path in args.annotations for record in read_annotations(path)]
+    paths = output_paths(records, output) if output else [None]*len(records)
+    tasks = list(zip(records, paths, [defaults]*len(records)))
+    rows = []   # Results store rows not yet appended
+
+    failed = 0
+    jobs = args.jobs or os.cpu_count()
+    chunksize = max(1, len(tasks) // (4 * jobs))    # Amortize pickling over many small images
+    with ProcessPoolExecutor(max_workers = jobs) as executor:
+        for image, result, error in executor.map(process_task, tasks, chunksize = chunksize):
+            if error:
+                failed += 1
+                print("FAILED %s (%s)" % (image, error), file = sys.stderr)
+            elif args.store:
+                rows.extend(result)     # Appended by this process only, in large transactions
+                if len(rows) >= 10000:
+                    append_rows(args.store, rows)
+                    rows = []
+            else:
+                print("%s -> %s" % (image, result))
+    if rows:
+        append_rows(args.store, rows)
+    print("Measured %d of %d images" % (len(tasks) - failed, len(tasks)))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,396 @@
+import numpy as np
+import functools
+
+# ------------------------------
+#   MorphoMetrix Geometry
+#   Curve math used by measurements, kept free of Qt so it can run headless
+#   scipy is imported on first curve fit (or by warm_up), it is the slowest import at startup
+# ------------------------------
+
+# Import scipy and fill caches used by every curve fit, run on a background thread at startup
+def warm_up():
+    from scipy.linalg import pascal
+    from scipy.interpolate import CubicSpline
+    for k in range(1, 8):   # Common numbers of length clicks
+        bezier_matrix(k)
+    legendre_nodes(24)
+
+# Bernstein coefficient matrix of a degree k Bezier curve in power basis
+# Cached per degree, returned array is read only
+@functools.cache
+def bezier_matrix(k):
+    from scipy.linalg import pascal
+    A = pascal(k+1, kind='lower') #generate Pascal triangle matrix
+    i, j = np.indices((k+1, k+1))
+    S = np.where(i >= j, (-1.0)**(i-j), 0.0) #signs matrix, alternating 1,-1 along lower diagonals
+    M = A*S #multiply pascals by signs to get Bernoulli polynomial matrix
+    coeff = A[-1,:]
+    C = (M*coeff[:,None]).astype(float) #broadcast, pascal returns python ints (object array) from k = 34 on
+    C.setflags(write=False)
+    return C
+
+# Gauss-Legendre nodes and weights, cached per quadrature degree
+@functools.cache
+def legendre_nodes(degree):
+    x, w = np.polynomial.legendre.leggauss(degree)
+    x.setflags(write=False)
+    w.setflags(write=False)
+    return x, w
+
+# Power basis [1, t, t^2, ..., t^k] for every value of t
+def power_basis(t, k):
+    return np.power.outer(np.asarray(t, dtype=float), np.arange(k+1))
+
+# Clip lines through points along directions to image bounds [0,L]x[0,H]
+# points, directions: (N,2) arrays, directions need not be normalized
+# Returns (N,2,2) array holding both boundary points of every line, picked in bound order
+# y=0, x=0, y=H, x=L. Rows whose line misses the image are NaN
+def clip_lines_to_box(points, directions, L, H, tol = 1):
+    points = np.asarray(points, dtype = float)
+    directions = np.asarray(directions, dtype = float)
+    x1, y1 = points[:,0,None], points[:,1,None]
+    vx, vy = directions[:,0,None], directions[:,1,None]
+
+    #parametric value along direction for every bound, inf for axis parallel directions
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        T = np.hstack(( (0 - y1)/vy, (0 - x1)/vx, (H - y1)/vy, (L - x1)/vx ))
+        xint = x1 + T*vx
+        yint = y1 + T*vy
+    #only keep intersect if inside image (1 pixel fudge factor)
+    valid = np.isfinite(T) & (xint <= L + tol) & (xint >= -tol) & (yint <= H + tol) & (yint >= -tol)
+
+    rows = np.arange(len(points))
+    first = np.argmax(valid, axis = 1)
+    valid &= np.abs(T - T[rows,first][:,None]) > 1e-9  #second point must differ (line through a corner hits two bounds)
+    second = np.argmax(valid, axis = 1)
+    found = valid[rows,second]
+
+    picks = np.stack((first, second), axis = 1)
+    ends = np.stack((xint[rows[:,None],picks], yint[rows[:,None],picks]), axis = -1)
+    ends[~found] = np.nan
+    return ends
+
+# Bilinear interpolation of image (H,W) at scene points P (...,2) of (x, y)
+# Pixel (i,j) covers [j,j+1)x[i,i+1), points past the outer pixel centers take the border value
+# Only the gathered pixels are converted to the dtype of P, image (e.g. uint8 luminance) is not copied
+def bilinear(image, P):
+    H, W = image.shape
+    x = np.clip(P[...,0] - 0.5, 0, W - 1)
+    y = np.clip(P[...,1] - 0.5, 0, H - 1)
+    x0 = np.minimum(x.astype(np.intp), max(W - 2, 0))
+    y0 = np.minimum(y.astype(np.intp), max(H - 2, 0))
+    x1 = np.minimum(x0 + 1, W - 1)
+    y1 = np.minimum(y0 + 1, H - 1)
+    fx, fy = x - x0, y - y0
+    pixel = lambda i, j: image[i,j].astype(fx.dtype)
+    top = pixel(y0,x0)*(1 - fx) + pixel(y0,x1)*fx
+    bottom = pixel(y1,x0)*(1 - fx) + pixel(y1,x1)*fx
+    return top*(1 - fy) + bottom*fy
+
+# Strongest intensity edge along every line from centers (N,2) to ends (N,M,2) in image (H,W)
+# Profiles are sampled every step pixels, smoothed with a Gaussian of sigma pixels and searched
+# from skip pixels past the center, returns (N,M,2) edge points with subpixel refinement
+# Lines without an edge (peak gradient below min_gradient intensity levels per pixel, e.g. a flat
+# or saturated region) keep their fallback (N,M,2) point
+def strongest_edges(image, centers, ends, fallback, sigma = 2.0, step = 1.0, skip = 4.0, min_gradient = 0.5):
+    D = ends - centers[:,None,:]
+    L = np.linalg.norm(D, axis = -1)
+    U = D / np.maximum(L, 1e-9)[...,None]
+    s = np.arange(int(np.ceil(L.max()/step)) + 1)*step     # Distance from center of every sample
+    P = centers[:,None,None,:] + s[:,None]*U[:,:,None,:]
+    profile = bilinear(image, P.astype(np.float32))
+
+    r = max(int(np.ceil(3*sigma/step)), 1)
+    kernel = np.exp(-0.5*(np.arange(-r, r + 1)*step/sigma)**2)
+    padded = np.pad(profile, ((0,0),(0,0),(r,r)), mode = 'edge')
+    smooth = np.lib.stride_tricks.sliding_window_view(padded, 2*r + 1, axis = -1) @ (kernel/kernel.sum()).astype(np.float32)
+
+    g = np.abs(np.gradient(smooth, axis = -1))
+    g[(s < skip) | (s > L[...,None])] = 0     # Too close to center or past image border
+    i = np.argmax(g, axis = -1)
+
+    # Parabola through neighbors of maximum
+    inner = np.clip(i, 1, len(s) - 2)
+    a, b, c = (np.take_along_axis(g, (inner + k)[...,None], axis = -1)[...,0] for k in (-1, 0, 1))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        offset = np.where((i == inner) & (a - 2*b + c < 0), 0.5*(a - c)/(a - 2*b + c), 0.0)
+    d = np.clip((i + offset)*step, 0, L)
+    edge = np.take_along_axis(g, i[...,None], axis = -1)[...,0] >= min_gradient
+    return np.where(edge[...,None], centers[:,None,:] + d[...,None]*U, fallback)
+
+class Curve():
+    """
+    Parametric length curve on t in [0,1] made of polynomial pieces joined at
+    breaks. Subclasses provide evaluate, derivative and second_derivative;
+    arc length and its inverse are shared.
+    """
+
+    def __init__(self, breaks, degree = 24, table_size = 256):
+        self.breaks = np.asarray(breaks, dtype = float)  #t values where polynomial pieces join
+        self.degree = degree  #quadrature degree used for arc length
+        self.table_size = table_size  #number of intervals in arc length table
+
+        pieces = self.integrate(self.breaks[:-1], self.breaks[1:])
+        self.offsets = np.concatenate(([0.0], np.cumsum(pieces)))  #arc length at every break
+        self.length = float(self.offsets[-1])  #total arc length
+
+    # Magnitude of tangent vector
+    def speed(self, t):
+        return np.linalg.norm(self.derivative(t), axis = -1)
+
+    # Arc length between a and b within a single piece (Gauss-Legendre quadrature)
+    def integrate(self, a, b, degree = None):
+        x, w = legendre_nodes(degree or self.degree)
+        a, b = np.asarray(a, dtype = float), np.asarray(b, dtype = float)
+        nodes = 0.5*(b - a)[...,None]*(x + 1) + a[...,None]  #map nodes from [-1,1] to [a,b]
+        return 0.5*(b - a)*np.sum(w*self.speed(nodes), axis = -1)
+
+    # Arc length from 0 to every value of t
+    def arc_length(self, t):
+        t = np.asarray(t, dtype = float)
+        piece = np.clip(np.searchsorted(self.breaks, t, side = 'right') - 1, 0, len(self.breaks) - 2)
+        return self.offsets[piece] + self.integrate(self.breaks[piece], t)
+
+    # Cumulative arc length sampled at dense t, computed on first use and kept with the curve
+    # Returns (t, s) arrays of length table_size + 1
+    @functools.cached_property
+    def arc_length_table(self):
+        t = np.linspace(0.0, 1.0, self.table_size + 1)
+        segments = self.integrate(t[:-1], t[1:], degree = 8)  #intervals are short, low order quadrature is exact enough
+        return t, np.concatenate(([0.0], np.cumsum(segments)))
+
+    # Parameter t at every arc length s
+    # Initial guess interpolated from arc_length_table (monotone), then polished with Newton steps
+    def inverse_arc_length(self, s, polish = 2):
+        s = np.asarray(s, dtype = float)
+        t_table, s_table = self.arc_length_table
+        t = np.interp(s, s_table, t_table)
+        for _ in range(polish):
+            speed = self.speed(t)
+            t = t - (self.arc_length(t) - s)/np.where(speed > 0, speed, np.inf)
+        return t
+
+class BezierCurve(Curve):
+    """
+    Bezier curve through control points P, built once per length measurement.
+    Power basis coefficients of the curve and of its derivative are computed
+    up front, so evaluating only builds the basis of t.
+    Cost and conditioning degrade with the number of control points, see SplineCurve.
+    """
+
+    def __init__(self, P, degree = 24, table_size = 256):
+        self.P = np.asarray(P, dtype = float)  #control points
+        self.kb = len(self.P) - 1  #order of bezier curve # of control points (n) - 1
+        self.Q = self.kb*np.diff(self.P, axis = 0)  #control points of derivative curve
+
+        self.coeffs = bezier_matrix(self.kb).dot(self.P)
+        self.dcoeffs = bezier_matrix(self.kb - 1).dot(self.Q)
+        if self.kb > 1:
+            self.ddcoeffs = bezier_matrix(self.kb - 2).dot((self.kb - 1)*np.diff(self.Q, axis = 0))
+        else:   #straight line
+            self.ddcoeffs = np.zeros((1, 2))
+        super(BezierCurve, self).__init__([0.0, 1.0], degree, table_size)
+
+    # Points on curve for every value of t, shape (N,2)
+    def evaluate(self, t):
+        return power_basis(t, self.kb).dot(self.coeffs)
+
+    # Tangent vectors for every value of t, shape (N,2)
+    def derivative(self, t):
+        return power_basis(t, self.kb - 1).dot(self.dcoeffs)
+
+    # Second derivative vectors for every value of t, shape (N,2)
+    def second_derivative(self, t):
+        return power_basis(t, len(self.ddcoeffs) - 1).dot(self.ddcoeffs)
+
+class SplineCurve(Curve):
+    """
+    Natural cubic spline through control points P, parameterized by chord length.
+    Building and evaluating scale linearly with the number of points and stay
+    well conditioned for long, densely clicked lengths.
+    """
+
+    def __init__(self, P, degree = 24, table_size = 256):
+        self.P = np.asarray(P, dtype = float)  #control points
+        keep = np.concatenate(([True], np.any(np.diff(self.P, axis = 0) != 0, axis = 1)))
+        knots = self.P[keep]  #drop repeated clicks, spline knots must be distinct
+        chords = np.hypot(*np.diff(knots, axis = 0).T)
+        u = np.concatenate(([0.0], np.cumsum(chords)))/np.sum(chords)
+
+        from scipy.interpolate import CubicSpline
+        self.spline = CubicSpline(u, knots, bc_type = 'natural')
+        super(SplineCurve, self).__init__(u, degree, table_size)
+
+    # Points on curve for every value of t, shape (N,2)
+    def evaluate(self, t):
+        return self.spline(t)
+
+    # Tangent vectors for every value of t, shape (N,2)
+    def derivative(self, t):
+        return self.spline(t, 1)
+
+    # Second derivative vectors for every value of t, shape (N,2)
+    def second_derivative(self, t):
+        return self.spline(t, 2)
+
+# Intersections of segment p-q with every segment A[i]-B[i] (A, B: (N,2) arrays)
+# Returns boolean mask of bounded intersections (end points included) and (N,2) intersection points
+def segment_intersections(p, q, A, B):
+    p, q = np.asarray(p, dtype = float), np.asarray(q, dtype = float)
+    A, B = np.asarray(A, dtype = float), np.asarray(B, dtype = float)
+    r, s, c = q - p, B - A, A - p
+    denom = r[0]*s[:,1] - r[1]*s[:,0]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = (c[:,0]*s[:,1] - c[:,1]*s[:,0])/denom  #parametric value along p-q
+        u = (c[:,0]*r[1] - c[:,1]*r[0])/denom  #parametric value along A-B
+    hit = np.isfinite(t) & np.isfinite(u) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    return hit, p + t[:,None]*r
+
+# Total length of polyline through (N,2) points
+def polyline_length(V):
+    return float(np.sum(np.hypot(*np.diff(np.asarray(V, dtype = float), axis = 0).T)))
+
+# Counter-clockwise angle in degrees [0,360) from direction d1 to direction d2
+# Image y axis points down, matches QLineF.angleTo
+def angle_between(d1, d2):
+    a1 = np.degrees(np.arctan2(-d1[1], d1[0])) % 360
+    a2 = np.degrees(np.arctan2(-d2[1], d2[0])) % 360
+    delta = (a2 - a1) % 360
+    return 0.0 if np.isclose(delta, 360) else float(delta)
+
+# Shoelace formula: https://www.theoremoftheday.org/GeometryAndTrigonometry/Shoelace/TotDShoelace.pdf
+# Signed area of closed polygon with (N,2) vertices
+def polygon_signed_area(V):
+    V = np.asarray(V, dtype = float)
+    x, y = V[:,0], V[:,1]
+    xn, yn = np.roll(x, -1), np.roll(y, -1)
+    return 0.5*np.sum(x*yn - y*xn)
+
+# Area of closed polygon with (N,2) vertices
+def polygon_area(V):
+    return abs(polygon_signed_area(V))
+
+# Perimeter of closed polygon with (N,2) vertices
+def polygon_perimeter(V):
+    V = np.asarray(V, dtype = float)
+    return float(np.sum(np.hypot(*(np.roll(V, -1, axis = 0) - V).T)))
+
+# Area centroid of closed polygon with (N,2) vertices, vertex mean if polygon is degenerate
+def polygon_centroid(V):
+    V = np.asarray(V, dtype = float)
+    x, y = V[:,0], V[:,1]
+    xn, yn = np.roll(x, -1), np.roll(y, -1)
+    cross = x*yn - y*xn
+    A = 0.5*np.sum(cross)
+    if A == 0:
+        return V.mean(axis = 0)
+    return np.array([np.sum((x + xn)*cross), np.sum((y + yn)*cross)])/(6*A)
+
+class PointBuffer():
+    """
+    Growable contiguous float64 (N,2) array of points.
+    Capacity doubles when full so appending is amortized O(1); array is a view
+    of the filled rows and stays valid until the next append.
+    """
+
+    def __init__(self, capacity = 16):
+        self.data = np.empty((capacity, 2), dtype = np.float64)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Filled rows, shape (N,2)
+    @property
+    def array(self):
+        return self.data[:self.count]
+
+    def append(self, x, y):
+        if self.count == len(self.data):
+            self.data = np.resize(self.data, (2*len(self.data), 2))
+        self.data[self.count] = (x, y)
+        self.count += 1
+
+    # Append (N,2) array of points
+    def extend(self, P):
+        n = self.count + len(P)
+        if n > len(self.data):
+            self.data = np.resize(self.data, (max(n, 2*len(self.data)), 2))
+        self.data[self.count:n] = P
+        self.count = n
+
+    def pop(self):
+        self.count -= 1
+        return self.data[self.count].copy()
+
+    def clear(self):
+        self.count = 0
+
+class SegmentGrid():
+    """
+    Uniform grid over segment bounding boxes for incremental polygon tracing.
+    Segments are appended and popped in stack order, query returns the indices
+    of segments sharing a grid cell with the bounding box of a query segment.
+    """
+
+    MAX_CELLS = 256     #segments covering more cells are kept in a list checked by every query
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = {}         #(i,j) -> list of segment indices
+        self.segments = []      #(key, cells) of every segment, key identifies the segment to its owner
+        self.large = []         #indices of segments spanning more than MAX_CELLS cells
+
+    def __len__(self):
+        return len(self.segments)
+
+    # Grid cells covered by bounding box of segment p-q
+    def cover(self, p, q):
+        i0, i1 = sorted((int(np.floor(p[0]/self.cell_size)), int(np.floor(q[0]/self.cell_size))))
+        j0, j1 = sorted((int(np.floor(p[1]/self.cell_size)), int(np.floor(q[1]/self.cell_size))))
+        return range(i0, i1 + 1), range(j0, j1 + 1)
+
+    # Add segment p-q, returns its index
+    def append(self, p, q, key = None):
+        index = len(self.segments)
+        xs, ys = self.cover(p, q)
+        if len(xs)*len(ys) > self.MAX_CELLS:
+            cells = None
+            self.large.append(index)
+        else:
+            cells = [(i, j) for i in xs for j in ys]
+            for cell in cells:
+                self.cells.setdefault(cell, []).append(index)
+        self.segments.append((key, cells))
+        return index
+
+    # Remove last added segment, returns its key
+    def pop(self):
+        index = len(self.segments) - 1
+        key, cells = self.segments.pop()
+        if cells is None:
+            self.large.pop()
+        else:
+            for cell in cells:
+                self.cells[cell].pop()  #last added segment is always at end of cell list
+                if not self.cells[cell]:
+                    del self.cells[cell]
+        return key
+
+    # Key of segment at index
+    def key(self, index):
+        return self.segments[index][0]
+
+    # Sorted indices of segments that may intersect segment p-q
+    def query(self, p, q):
+        xs, ys = self.cover(p, q)
+        found = set(self.large)
+        if len(xs)*len(ys) > len(self.cells):   #query larger than occupied grid, scan occupied cells
+            for (i, j), indices in self.cells.items():
+                if i in xs and j in ys:
+                    found.update(indices)
+        else:
+            for i in xs:
+                for j in ys:
+                    found.update(self.cells.get((i, j), ()))
+        return sorted(found)
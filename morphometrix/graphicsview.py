@@ -1,13 +1,14 @@
-from PySide6.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QGraphicsTextItem, QGraphicsLineItem, QGraphicsPixmapItem, QGraphicsPolygonItem
+from PySide6.QtWidgets import QApplication, QGraphicsView, QGraphicsScene, QGraphicsTextItem, QGraphicsLineItem, QGraphicsPolygonItem, QGraphicsItem, QStyleOptionGraphicsItem
 from PySide6 import QtGui, QtCore
 from PySide6.QtGui import QFont, QPixmap
 from PySide6.QtCore import Qt, QLineF
-from scipy.linalg import pascal
-from scipy.sparse import diags
-from scipy.optimize import root_scalar
-from itertools import cycle, islice
+from measurement import Measurement, consts, measurement_rows
+from tiledimage import TiledImageItem, TileCache, ImagePyramid, read_image
+from instrumentation import timed
+from history import History, AddMeasurement, AddPoints, Finish, MoveHandle
+from scheduler import RenderScheduler
 import numpy as np
-import sys, os, types
+import sys, os, functools
 
 # ------------------------------
 #   MorphoMetrix GraphicsView Class - Developed By:
@@ -17,24 +18,6 @@ import sys, os, types
 #       Elliott Chimienti
 # ------------------------------
 
-consts = types.SimpleNamespace()
-# State case constants
-consts.LENGTH = 1
-consts.AREA = 2
-consts.ANGLE = 3
-consts.WIDTH = 4
-
-# Object type constants
-consts.LINEITEM = 1
-consts.PATHITEM = 2
-consts.ELLIPSEITEM = 3
-consts.FONTITEM = 4
-consts.POLYGONITEM = 5
-
-# Side bias constants
-consts.SIDE_A = 0
-consts.SIDE_B = 1
-
 class imwin(QGraphicsView):
     def __init__(self, parent=None):
         super(imwin, self).__init__(parent)
@@ -46,9 +29,18 @@ class imwin(QGraphicsView):
         self.opacity_pos = 10                       # Used by Ellipse Class
         self.numwidths = None                       # User defined for width measurements
         self.measurement_stack = []                 # Initialize Empty Stack (FIFO)
+        self.layers = {}                            # Graphics items of every measurement on stack (MeasurementItems)
+        self.history = History()                    # Undo/redo steps of measurement stack
         self.measuring_state = None                 # Current measuring state
-        self.pixmap = None                          # Background image
+        self.image_item = None                      # Background image (TiledImageItem, added once per project)
+        self.tile_cache = TileCache()               # Tile pixmaps of background image, memory budgeted
         self.crosshair_shape = "Crosshair"
+        self.preview_line = None                    # Rubber band segment of in-progress measurement
+        self.preview_polygon = None                 # Live area polygon of in-progress measurement
+        self.scheduler = RenderScheduler(self)      # Coalesces slider, mouse move and wheel updates
+        self.preview_pos = None                     # Latest cursor scene position for rubber band
+        self.zoom_factor = 1.0                      # Wheel zoom accumulated since last flush
+        self.zoom_pos = None                        # Viewport position of latest wheel event
         
         self.setMouseTracking(True)
         self.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
@@ -56,77 +48,91 @@ class imwin(QGraphicsView):
         self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
 
     # New project
-    def new_project(self,image_path):
+    # Decoded ImagePyramid of image_path can be passed in, otherwise image is read here
+    # Image is decoded before anything is cleared, so an unreadable image (IOError) leaves current project intact
+    def new_project(self,image_path, pyramid = None):
+        if pyramid is None:
+            pyramid = ImagePyramid(read_image(image_path))
+
         self.measurement_stack.clear()
+        self.history.clear()
         self.measuring_state = None
-        self.pixmap = None
+        self.image_item = None
+        self.tile_cache.clear()
+        self.preview_line = None
+        self.preview_polygon = None
+        self.scheduler.cancel("preview")
+        self.scheduler.cancel("zoom")
+        self.zoom_factor = 1.0
+        self.layers.clear()
         self.scene.clear()
 
-        self.pixmap = QtGui.QPixmap(image_path)
-        self.scene.addPixmap(self.pixmap)
-        self.setSceneRect(QtCore.QRectF(0.0, 0.0, self.pixmap.width(), self.pixmap.height()))   # Set Scenerect to size of pixmap
+        self.image_item = TiledImageItem(pyramid, self.tile_cache)
+        self.scene.addItem(self.image_item)
+        self.setSceneRect(self.image_item.boundingRect())   # Set Scenerect to size of image
         self.fitInView(self.scene.sceneRect(), QtCore.Qt.AspectRatioMode.KeepAspectRatio)
         self.scene.update()
 
+    # Put measurements of a saved project on stack and draw them
+    def load_measurements(self, measurement_stack, measuring_state = None):
+        self.measurement_stack.extend(measurement_stack)
+        self.measuring_state = measuring_state     # Unfinished measurement can be continued
+        self.draw_scene()
+
     # Push command(s) to stack
     def push_stack(self, name, measurement_type):
+        state_before = self.measuring_state
         self.measuring_state = measurement_type
         self.measurement_stack.append(Measurement(measurement_type,name))   # Set object type to item by default
+        self.record([AddMeasurement(self.measurement_stack[-1])], state_before)
         self.update_application()
 
-    # Pop last command from stack and update graphicsview
+    # Record commands of one user action as one undo step, measuring state after it is the current one
+    def record(self, commands, state_before):
+        self.history.record(commands, state_before, self.measuring_state)
+
+    # Undo last step, only measurements it changed are redrawn
     def undo(self):
-        if len(self.measurement_stack) > 0:
-            last_measurement = self.measurement_stack[-1]         # Grab latest object
-            if len(last_measurement.objects_params) == 1 or last_measurement.objects_params[-1]["type"] == consts.PATHITEM or last_measurement.get_type() == consts.WIDTH:
-                self.measurement_stack.pop()
-                self.measuring_state = None
-            elif len(last_measurement.objects_params) > 1:  # If object holds multiple items
-                last_measurement.rem_object()           # Remove last item
-                self.measuring_state = last_measurement.get_type()    # Update measurement state
-                self.update_prev_lineitem(last_measurement)
-            else:
-                self.measurement_stack.pop()
-                self.undo()                # Call self until graphics item is removed or no measurements
-                return                      # No need to update scene twice
-            self.draw_scene()               # Update scene after update
-   
-    # Custom clear scene implementation (Does not destroy custom ellipse class from memory)
-    def clear_scene(self):
-        for item in self.scene.items():
-            self.scene.removeItem(item)
-   
-    # Re-draw QGraphicsView with commands from FIFO stack
+        if not self.history.can_undo() and len(self.measurement_stack) > 0:    # Measurements loaded from a project have no history
+            self.history.assume([AddMeasurement(self.measurement_stack[-1])], None, self.measuring_state)
+        self.apply_step(self.history.undo(self.measurement_stack))
+
+    # Redo last undone step
+    def redo(self):
+        self.apply_step(self.history.redo(self.measurement_stack))
+
+    # Sync graphics items of measurements changed by an undo/redo step and restore its measuring state
+    def apply_step(self, step):
+        if step is None:
+            return
+        changed, self.measuring_state = step
+        for measurement, on_stack in changed:
+            if on_stack:
+                if measurement not in self.layers:
+                    self.layers[measurement] = MeasurementItems(self, measurement)
+                self.layers[measurement].sync()
+            elif measurement in self.layers:
+                self.layers.pop(measurement).remove()
+        if self.measuring_state and len(self.measurement_stack) > 0 and self.measurement_stack[-1].has_points():
+            self.update_preview(self.measurement_stack[-1], self.mapToScene(self.viewport().mapFromGlobal(QtGui.QCursor.pos())))
+        else:
+            self.set_preview(None, None)
+        self.update_application()
+
+    # Sync QGraphicsScene with FIFO stack (Retained mode)
+    # Graphics items persist between calls, only measurements that changed are touched
+    @timed("draw_scene")
     def draw_scene(self):
-        self.clear_scene()  # Clear scene
-        self.scene.addPixmap(self.pixmap)   # Add pixmap
-        
         for measurement in self.measurement_stack:  # For every measurement
-            for item in measurement.get_objects():  # For every object in measurement
-                match item["type"]:
-                    case consts.LINEITEM:
-                        self.scene.addItem(QGraphicsLineItem(item["parms"]))
-                    case consts.ELLIPSEITEM:
-                        item["parms"].update_crosshair(self.slider_pos, self.opacity_pos)
-                        self.scene.addItem(item["parms"])
-                    case consts.PATHITEM:
-                        self.scene.addPath(item["parms"])
-                    case consts.POLYGONITEM:
-                        ellipse = QGraphicsPolygonItem(item["parms"])
-                        ellipse.setBrush(QtGui.QBrush(QtGui.QColor(255,255,255,127)))
-                        self.scene.addItem(ellipse)
-                    case consts.FONTITEM:
-                        font = QFont()
-                        font.setPointSize(40)
-                        font.setWeight(QFont.Weight.Bold)
-                        font.setPixelSize(int(self.pixmap.width()/30))  # Set text size relative to image dimensions
-                        textItem = QGraphicsTextItem(item["parms"])
-                        textItem.setFont(font)
-                        textItem.setPos(item["pos"])
-                        self.scene.addItem(textItem)         
+            if measurement not in self.layers:
+                self.layers[measurement] = MeasurementItems(self, measurement)
+            self.layers[measurement].sync()
+        if not self.measuring_state:    # Nothing in progress, remove rubber band
+            self.set_preview(None, None)
         self.update_application()
 
     # Updates GUI elements (Mouse pointer, toolbar toggles, etc.) after drawing to screen
+    @timed("update_application")
     def update_application(self):
         # Update mouse cursor
         if self.dragMode() == QGraphicsView.DragMode.ScrollHandDrag:
@@ -144,6 +150,10 @@ class imwin(QGraphicsView):
             self.parent().statusbar.showMessage('Select a measurement to make from the toolbar')
             self.parent().disable_undo()
             self.parent().disable_export()
+        if self.history.can_redo():
+            self.parent().enable_redo()
+        else:
+            self.parent().disable_redo()
 
         self.parent().clear_button_highlights()
         self.parent().disable_all_measurements()
@@ -154,7 +164,7 @@ class imwin(QGraphicsView):
             # Enable all buttons but width
             self.parent().enable_all_measurements()
             # If last measurement was length
-            if len(self.measurement_stack) > 0 and self.measurement_stack[-1].objects_params[-1]["type"] == consts.PATHITEM:
+            if len(self.measurement_stack) > 0 and self.measurement_stack[-1].curve is not None:
                 self.parent().enable_width_measurement()    # Enable width button     
 
     # Changes size of ellipses drawn on screen
@@ -162,7 +172,14 @@ class imwin(QGraphicsView):
     def slider_moved(self, width_value, opactity_value):
         self.slider_pos = width_value
         self.opacity_pos = opactity_value
-        self.draw_scene()
+        self.scheduler.schedule("crosshair", self.update_crosshairs)  # Once per burst of slider ticks
+
+    # Restyle width handles with latest slider values
+    @timed("update_crosshairs")
+    def update_crosshairs(self):
+        for layer in self.layers.values():  # Only width handles depend on slider values
+            if layer.widths is not None:
+                layer.widths.update_crosshair(self.slider_pos, self.opacity_pos)
                 
     # Activated every key press
     def keyPressEvent(self, event):  #shift modifier for panning
@@ -179,293 +196,151 @@ class imwin(QGraphicsView):
             self.update_application()
 
     # PySide event called every mouse move
+    @timed("mouseMoveEvent")
     def mouseMoveEvent(self, event):
         mousePos = self.mapToScene(event.position().toPoint())
         if self.dragMode() == QGraphicsView.DragMode.ScrollHandDrag:    # If User is dragging scene
             delta = mousePos - self.dragPos
             self.translate(delta.x(), delta.y())
         elif self.measuring_state and len(self.measurement_stack) > 0:  # If User is creating a measurement
-            cur_measurment = self.measurement_stack[-1]
-            match self.measuring_state:
-                case consts.AREA:
-                    if cur_measurment.has_objects():    # If measurement exists, have p2 follow mouse
-                        self.intersect_handler(cur_measurment)      # Check for area intersect
-                        self.draw_scene()   # Update scene
-                case _:     # Default
-                    if cur_measurment.has_objects():    # If measurement exists, have p2 follow mouse
-                        self.update_prev_lineitem(cur_measurment)
-                        self.draw_scene()   # Update scene
+            self.preview_pos = mousePos
+            self.scheduler.schedule("preview", self.flush_preview)    # Rubber band follows latest position only
 
         super().mouseMoveEvent(event)
 
-    # Used by mousemoveevent
-    # Checks if QLineF's in area measurement intersect
-    # Handles add/removal of area polygon
-    def intersect_handler(self, measurement):
-        # Check if area ellipse already exists (Should always be last appended item)
-        if measurement.objects_params[-1]["type"] == consts.POLYGONITEM:
-            measurement.rem_object()
-
-        self.update_prev_lineitem(measurement)  # Update previous line measurement
-        
-        if len(measurement.objects_params) > 2: # Check if more than 2 lines exist
-            last_line = measurement.objects_params[-1]["parms"] # Grab last QLineF
-            for i in range(len(measurement.objects_params) -2): # Check if intersects with any line but its neighbor
-                inter_check = last_line.intersects(measurement.objects_params[i]["parms"])
-                if inter_check[0] == QLineF.IntersectionType.BoundedIntersection:    # Add ellipse
-                    points = []
-                    for point in measurement.objects_params[i:]:
-                        points.append(point["parms"].p2())
-                    points.append(inter_check[1])   # Add intersection point
-                    measurement.append_object({
-                        "parms": QtGui.QPolygonF(points),
-                        "type": consts.POLYGONITEM
-                    })
-                    return  # end intersect check
+    # Move rubber band of in-progress measurement to latest cursor position
+    @timed("flush_preview")
+    def flush_preview(self):
+        if self.measuring_state and len(self.measurement_stack) > 0:
+            cur_measurment = self.measurement_stack[-1]
+            if cur_measurment.has_points():    # If measurement exists, have rubber band follow mouse
+                self.update_preview(cur_measurment, self.preview_pos)
 
     # Used by Mousemoveevent
-    # Updates point #2 of last lineItem object to mousePos
-    def update_prev_lineitem(self, cur_measurment):
-        mousePos = self.mapToScene(self.mapFromGlobal(QtGui.QCursor.pos()))
-        last_pos = cur_measurment.objects_params[-1]["parms"].p1()
-        cur_measurment.objects_params[-1]["parms"] = QtCore.QLineF(last_pos,mousePos)   # Update LineF
+    # Updates rubber band from last placed point to mousePos (Measurement stack is not modified)
+    def update_preview(self, cur_measurment, mousePos):
+        last_pos = QtCore.QPointF(*cur_measurment.last_point())
+        line = QLineF(last_pos,mousePos)
+        polygon = None
+        if cur_measurment.get_type() == consts.AREA:
+            polygon = cur_measurment.intersect_polygon(mousePos.toTuple())  # Check for area intersect
+        self.set_preview(line, polygon)
+
+    # Replace preview geometry and repaint only the region it covered before and after
+    def set_preview(self, line, polygon):
+        dirty = self.preview_rect()
+        self.preview_line = line
+        self.preview_polygon = polygon
+        dirty = dirty.united(self.preview_rect())
+        if not dirty.isNull():
+            self.viewport().update(self.mapFromScene(dirty).boundingRect().adjusted(-2,-2,2,2))
+
+    # Scene rect covered by preview geometry
+    def preview_rect(self):
+        rect = QtCore.QRectF()
+        if self.preview_line is not None:
+            rect = QtCore.QRectF(self.preview_line.p1(), self.preview_line.p2()).normalized()
+        if self.preview_polygon is not None:
+            (x0, y0), (x1, y1) = self.preview_polygon.min(axis = 0), self.preview_polygon.max(axis = 0)
+            rect = rect.united(QtCore.QRectF(x0, y0, x1 - x0, y1 - y0))
+        if rect.isNull():
+            return rect
+        return rect.adjusted(-1,-1,1,1)    # Pen width margin
+
+    # Paint preview layer on top of scene
+    def drawForeground(self, painter, rect):
+        painter.setPen(QtGui.QPen())
+        if self.preview_polygon is not None:
+            painter.setBrush(QtGui.QBrush(QtGui.QColor(255,255,255,127)))
+            painter.drawPolygon(to_qpolygon(self.preview_polygon))
+        if self.preview_line is not None:
+            painter.drawLine(self.preview_line)
 
     # PySide event called every double click
     def mouseDoubleClickEvent(self, event):
         mousePos = self.mapToScene(event.position().toPoint())
-        cur_measurment = self.measurement_stack[-1]
         if self.measuring_state == consts.LENGTH:
-            # Check if bezier option is checked
             self.parent().statusbar.showMessage('Length measurement complete.')
-            if self.parent().bezier.isChecked():
-                last_pos = cur_measurment.objects_params[-1]["parms"].p2()
-                cur_measurment.append_object({
-                    "parms": QLineF(last_pos,mousePos),
-                    "type": consts.LINEITEM
-                    })
-                self.calculate_curve()
-            else:
-                self.calculate_length(cur_measurment)
+            cur_measurment = self.measurement_stack[-1]
+            n, before = len(cur_measurment.points), Finish.state(cur_measurment)
+            self.calculate_curve(cur_measurment, mousePos)
             self.measuring_state = None # Reset to default values
+            self.record([AddPoints(cur_measurment, cur_measurment.points.array[n:]), Finish(cur_measurment, before)], consts.LENGTH)
         self.draw_scene()
 
+    # Finish length measurement at double click point mousePos
+    @timed("calculate_curve")
+    def calculate_curve(self, cur_measurment, mousePos):
+        # Check if a curve option (bezier/spline) is checked
+        if self.parent().bezier.isChecked() or self.parent().spline.isChecked():
+            # Last point is repeated before the double click point, as the line based model did, so fitted lengths are unchanged
+            cur_measurment.add_point(*cur_measurment.last_point())
+            cur_measurment.add_point(mousePos.x(), mousePos.y())
+            cur_measurment.fit_curve(spline = self.parent().spline.isChecked())
+        else:
+            cur_measurment.calculate_length()
+
     # Called every mouse click in scene
     def mousePressEvent(self, event):
         if len(self.measurement_stack) > 0 and self.measuring_state:
             mousePos = self.mapToScene(event.position().toPoint())
             cur_measurment = self.measurement_stack[-1]
+            state_before, before = self.measuring_state, Finish.state(cur_measurment)
+            commands = [AddPoints(cur_measurment, [mousePos.toTuple()])]
             match self.measuring_state:
                 case consts.LENGTH:
-                    self.add_line_item(cur_measurment,mousePos)
+                    cur_measurment.add_point(mousePos.x(), mousePos.y())
                 case consts.ANGLE:
-                    if cur_measurment.has_objects() and len(cur_measurment.get_objects()) >= 2:
-                        self.calculate_angle(cur_measurment)
+                    cur_measurment.add_point(mousePos.x(), mousePos.y())
+                    if len(cur_measurment.points) == 3:    # Two lines placed
+                        cur_measurment.calculate_angle()
+                        commands.append(Finish(cur_measurment, before))
                         self.parent().statusbar.showMessage('Angle measurement complete')
                         self.measuring_state = None
-                    else:
-                        self.add_line_item(cur_measurment,mousePos)
                 case consts.AREA:
-                    if cur_measurment.has_objects() and cur_measurment.objects_params[-1]["type"] == consts.POLYGONITEM:
-                        self.calculate_area(cur_measurment)
+                    polygon = None
+                    if cur_measurment.has_points():
+                        polygon = cur_measurment.intersect_polygon(mousePos.toTuple())
+                    if polygon is not None:     # Click closes polygon
+                        cur_measurment.close_polygon(polygon)
+                        commands = [Finish(cur_measurment, before)]
                         self.parent().statusbar.showMessage('Polygon area measurement completed')
                         self.measuring_state = None
                     else:
-                        self.add_line_item(cur_measurment,mousePos)
+                        cur_measurment.add_point(mousePos.x(), mousePos.y())
+            self.record(commands, state_before)
             self.draw_scene()
+            if self.measuring_state:
+                self.update_preview(cur_measurment, mousePos)
         super().mousePressEvent(event)
 
-    # Adds lineItem to measurement
-    def add_line_item(self,measurement,mousePos):
-        if measurement.has_objects():
-            last_pos = measurement.objects_params[-1]["parms"].p2()
-            measurement.append_object({
-                "parms": QLineF(last_pos,mousePos),
-                "type": consts.LINEITEM
-                })
-        else:
-            measurement.append_object({
-                "parms": QLineF(mousePos,mousePos),
-                "type": consts.LINEITEM
-                })
-
-    # Used to calculate and draw bezier curve
-    def calculate_curve(self):
-        measurement = self.measurement_stack[-1]
-
-        L = posData(
-                np.empty(shape=(0, 0)),
-                np.empty(shape=(0, 0)))
-        top_object = measurement.objects_params[0]["parms"]
-
-        L.update(top_object.p1().x(),top_object.p1().y())
-        for object in measurement.get_objects():    # Grab all remaining points
-            L.update(object["parms"].p2().x(),object["parms"].p2().y())
-
-        nt = 100 #max(1000, self.numwidths * 50)  #num of interpolating points
-        t = np.linspace(0.0, 1.0, nt)
-        P = np.vstack((L.x, L.y)).T #control points
-        kb = len(P) - 1 #order of bezier curve # of control points (n) - 1
-
-        B = bezier(t, P, k = kb) #evaluate bezier curve along t
-        Q = kb*np.diff(P, axis = 0)
-        
-        measurement.measurement_value = gauss_legendre(b = 1, f = bezier, P = Q, k = kb - 1, arc = True) #compute total arc length.
-        measurement.Q = Q
-        measurement.kb = kb
-        measurement.P = P
-        measurement.objects_params.clear()                    # Clear object array for curve
-
-        xs, ys = B[:,0], B[:,1]
-
-        for i in range(1, nt - 1):
-            P0 = QtCore.QPointF( xs[i-1], ys[i-1] )#.toPoint()
-            P1 = QtCore.QPointF( xs[i  ], ys[i  ] )#.toPoint()
-            P2 = QtCore.QPointF( xs[i+1], ys[i+1] )#.toPoint()
-
-            path = QtGui.QPainterPath(P0)
-            path.cubicTo(P0, P1, P2)
-            measurement.append_object({
-                        "parms": path,
-                        "type": consts.PATHITEM
-                        })
-            
-    # Calculate total length of length measurement
-    def calculate_length(self, measurement):
-        measurement.measurement_value = sum([l["parms"].length() for l in measurement.objects_params])
-
-    # Calculate qreal (PySide degrees) of a finished angle measurement
-    def calculate_angle(self, measurement):
-        lines = measurement.get_objects()
-        measurement.measurement_value = lines[0]["parms"].angleTo(lines[1]["parms"])
-
-    def calculate_area(self, measurement):
-        qpolygon = measurement.objects_params[-1]["parms"]
-
-        # Shoelace formula: https://www.theoremoftheday.org/GeometryAndTrigonometry/Shoelace/TotDShoelace.pdf
-        S1 = sum((qpolygon[i].x()*qpolygon[i+1].y())-(qpolygon[i].y()*qpolygon[i+1].x()) for i in range(len(qpolygon)-1))
-        conct = (qpolygon[-1].x()*qpolygon[0].y())-(qpolygon[-1].y()*qpolygon[0].x())
-        measurement.measurement_value = 0.5*abs(S1+conct)
-
     # Calculates distance in pixels of wdiths measurement
-    # Calculate on export due to MovingEllipse being a dynamic item
+    # Calculate on export due to width handles being dragged
     def calculate_widths(self,bias):
         for measurement in self.measurement_stack:  # For every measurement
             if measurement.get_type() == consts.WIDTH:  # Find width measurements
-                width_array = []
-                side_A_width = []
-                side_B_width = []
-                for item in measurement.get_objects():
-                    if item["type"] == consts.ELLIPSEITEM:
-                        match item["parms"].side:
-                            case consts.SIDE_A:
-                                side_A_width.append(item["parms"])
-                            case consts.SIDE_B:
-                                side_B_width.append(item["parms"])
-    
-                for A,B in zip(side_A_width,side_B_width):
-                    match bias:
-                        case "Side A":
-                            width_array.append(QLineF(A.scenePos(), A.centerLinePoint).length())
-                        case "Side B":
-                            width_array.append(QLineF(B.scenePos(),B.centerLinePoint).length())
-                        case _: # None
-                            width_array.append(QLineF(A.scenePos(),B.scenePos()).length())
-                measurement.measurement_value = width_array    # Calculated in pixels
+                measurement.calculate_widths(bias)
 
     # Iterates over measurement stack to return names and values of measurements
     def get_measurement_names_and_values(self, m):
-        pixel_measurement = []
-        unit_measurement = []   # meters
-        for measurement in self.measurement_stack:
-            match measurement.get_type():
-                case consts.WIDTH:
-                    num_widths = len(measurement.measurement_value)
-                    for i in range(num_widths):
-                        pixel_measurement.append([measurement.get_name()+"_w"+"{0:.1f}".format((i+1)/(num_widths+1)*100),"{0:.2f}".format(measurement.measurement_value[i]), "Pixels"])
-                        unit_measurement.append([measurement.get_name()+"_w"+"{0:.1f}".format((i+1)/(num_widths+1)*100), "{0:.2f}".format(measurement.measurement_value[i]*m), "Meters"])
-                case consts.LENGTH:
-                    pixel_measurement.append([measurement.get_name(),"{0:.2f}".format(measurement.measurement_value), "Pixels"])
-                    unit_measurement.append([measurement.get_name(), "{0:.2f}".format(measurement.measurement_value*m), "Meters"])
-                case consts.ANGLE:
-                    pixel_measurement.append([measurement.get_name(), "{0:.2f}".format(measurement.measurement_value), "Degrees"])
-                    unit_measurement.append([measurement.get_name(), "{0:.2f}".format(measurement.measurement_value), "Degrees"])
-                case consts.AREA:
-                    pixel_measurement.append([measurement.get_name(), "{0:.2f}".format(measurement.measurement_value), "Pixels"])
-                    unit_measurement.append([measurement.get_name(), "{0:.2f}".format(measurement.measurement_value*(m**2)), "Square Meters"])
-        return pixel_measurement, unit_measurement
+        return measurement_rows(self.measurement_stack, m)
 
     # Measure widths of aquatic animal (Called when GUI button is pressed)
+    @timed("measure_widths")
     def measure_widths(self):        
-        if len(self.measurement_stack) > 0 and self.measurement_stack[-1].measurement_type == consts.LENGTH:
+        if len(self.measurement_stack) > 0 and self.measurement_stack[-1].curve is not None:
             self.parent().statusbar.showMessage('Drag width segment points to make width measurements perpendicular to the length segment')
             last_measurement = self.measurement_stack[-1]
-            self.push_stack(last_measurement.get_name(), 4)
-            width_measurement = self.measurement_stack[-1]
+            width_measurement = Measurement(consts.WIDTH, last_measurement.get_name())
             numwidths = int(self.parent().subWin.numwidths.text())-1
-            k = 0
-
-            s_i = np.linspace(0,1,numwidths+2)[1:-1]    #only need to draw widths for inner pts
-            t_i = np.array([root_scalar(gauss_legendre, x0 = s_i, bracket = [-1,1], method = "bisect", args = (bezier, last_measurement.Q, last_measurement.kb-1, True, s, last_measurement.measurement_value) ).root for s in s_i])
-            B_i = bezier(np.array(t_i), P = last_measurement.P, k = last_measurement.kb)
-
-            #Find normal vectors by applying pi/2 rotation matrix to tangent vector
-            bdot = bezier(t_i, P = last_measurement.Q, k = last_measurement.kb - 1)
-            mag = np.linalg.norm(bdot,axis = 1) #normal vector magnitude
-            bnorm = np.flip(bdot/mag[:,None],axis = 1)
-            bnorm[:,0] *= -1
-            
-            for k,(pt,m) in enumerate(zip(B_i,bnorm)):
-                x1, y1 = pt[0],pt[1]
-                vx, vy = m[0], m[1]
-                L = self.pixmap.width()
-                H = self.pixmap.height()
-
-                xi,yi = [], []
-                for bound in ([0,0],[L,H]):
-                    for ev in ([1,0],[0,1]):
-                        A = np.matrix([ [vx, ev[0]] , [vy, ev[1]] ])
-                        b = np.array([bound[0] - x1, bound[1] - y1])
-                        T = np.linalg.solve(A,b)[0] #only need parametric value for our vector, not bound vector
-
-                        xint = x1 + T*vx
-                        yint = y1 + T*vy
-                        if ( (xint<=L + 1) and (xint>=0-1) and (yint<=H+1) and (yint>=0-1) ): #only add intersect if conditions met.
-                            #1 pixel fudge factor required?
-                            xi.append(xint)
-                            yi.append(yint)
-
-                # Draw width lines (And draw starting points)
-                for l, (x, y) in enumerate(zip(xi,yi)):
-
-                    start = QtCore.QPointF(x1, y1)
-                    end = QtCore.QPointF(x, y)
-
-                    # if this is the first itertion
-                    if k == 0:
-                        # Set distance from linear measurement
-                        lineLength = np.sqrt((start.x()-end.x())**2 + (start.y()-end.y())**2)
-                        t = (500)/lineLength # Ratio of desired distance from center / total length of line
-                        posAB = QtCore.QPointF(((1-t)*start.x()+t*end.x()),((1-t)*start.y()+t*end.y()))
-                        if l == 0:
-                            width_measurement.append_object({
-                                "parms": str("A"),
-                                "pos": posAB,
-                                "type": consts.FONTITEM
-                            })
-                        elif l == 1:
-                            width_measurement.append_object({
-                                "parms": str("B"),
-                                "pos": posAB,
-                                "type": consts.FONTITEM
-                            })
-                    width_measurement.append_object({   # Append Ellipse
-                                "parms": MovingEllipse(self, start, end, self.slider_pos, l%2, self.parent().subWin.width_tabs.currentText()),
-                                "type": consts.ELLIPSEITEM
-                            })
-                    width_measurement.append_object({   # Append Line
-                                "parms": QtCore.QLineF(start, end),
-                                "type": consts.LINEITEM
-                            })
+            scaledSize = 10 + (self.slider_pos*10)  # Handles start 3 crosshair sizes from length curve
+            width_measurement.place_widths(last_measurement, numwidths, self.image_item.width(), self.image_item.height(), scaledSize*3)
+            if self.parent().subWin.snap_widths.isChecked() and len(width_measurement.centers) > 0:
+                width_measurement.snap_widths(self.image_item.pyramid.luminance())    # Handles proposed at image edges
+                self.parent().statusbar.showMessage('Width handles snapped to image edges, drag outliers to correct')
+            self.measurement_stack.append(width_measurement)
+            state_before, self.measuring_state = self.measuring_state, None
+            self.record([AddMeasurement(width_measurement)], state_before)
         self.measuring_state = None
         self.draw_scene()
 
@@ -485,6 +360,11 @@ class imwin(QGraphicsView):
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
 
+    # Frame time of scene repaint
+    @timed("paint")
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
     # Zoom
     def wheelEvent(self, event):
         #https://stackoverflow.com/questions/35508711/how-to-enable-pan-and-zoom-in-a-qgraphicsview
@@ -494,10 +374,6 @@ class imwin(QGraphicsView):
         zoomInFactor = 1.05
         zoomOutFactor = 1 / zoomInFactor
 
-        # self.setTransformationAnchor(QGraphicsView.ViewportAnchor.NoAnchor)
-        # self.setResizeAnchor(QGraphicsView.ViewportAnchor.NoAnchor)
-        oldPos = self.mapToScene(event.position().toPoint())
-
         #Zoom
         # https://quick-geek.github.io/answers/885796/index.html
         # y-component for mouse with two wheels
@@ -505,9 +381,20 @@ class imwin(QGraphicsView):
             zoomFactor = zoomInFactor
         else:
             zoomFactor = zoomOutFactor
-        self.scale(zoomFactor, zoomFactor)
+        self.zoom_factor *= zoomFactor      # Wheel bursts are applied as one zoom
+        self.zoom_pos = event.position().toPoint()
+        self.scheduler.schedule("zoom", self.flush_zoom)
+
+    # Apply accumulated wheel zoom around latest wheel position
+    @timed("flush_zoom")
+    def flush_zoom(self):
+        # self.setTransformationAnchor(QGraphicsView.ViewportAnchor.NoAnchor)
+        # self.setResizeAnchor(QGraphicsView.ViewportAnchor.NoAnchor)
+        oldPos = self.mapToScene(self.zoom_pos)
+        self.scale(self.zoom_factor, self.zoom_factor)
+        self.zoom_factor = 1.0
 
-        newPos = self.mapToScene(event.position().toPoint())  #Get the new position
+        newPos = self.mapToScene(self.zoom_pos)  #Get the new position
         delta = newPos - oldPos
         self.translate(delta.x(), delta.y())  #Move scene to old position
         
@@ -522,215 +409,270 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
-# Ellipse QGraphicsItem Class
-# A grabable object to change width measurements dynamically
-# Ellipse is bound to parent line
-# Input: Point P1 (QPointF), Point P2 (QPointF)
-class MovingEllipse(QGraphicsPixmapItem):
-    def __init__(self, parent,lp1, lp2, scale, side, shape_type):
-        # LP2 is always border point (PyQt6.QtCore.QPointF(1030.9353133069922, 0.0))
-        super(MovingEllipse,self).__init__()
-
-        scaledSize = 10 + (scale*10)
-        self.shape_key = shape_type
-        match self.shape_key:
-            case "Crosshair":   # Save user selected shape type
-                Image = QPixmap(resource_path("crosshair.png")).scaled(scaledSize,scaledSize)
-            case "Dot":
-                Image = QPixmap(resource_path("dot.png")).scaled(scaledSize,scaledSize)
-        
-        self.color = parent.picked_color
-        self.setOpacity(parent.opacity_pos)
-        self.Pixmap = QPixmap(Image.size())
-        self.Pixmap.fill(self.color)
-        self.Pixmap.setMask(Image.createMaskFromColor(Qt.GlobalColor.transparent))
-
-        self.setPixmap(self.Pixmap)
-        self.setOffset(QtCore.QPointF(-scaledSize/2,-scaledSize/2)) # Set offset to center of image
-        
-        self.centerLinePoint = lp1  # Used in width measurement
-        self.side = side
-        self.p1 = lp1   # Boundry points
-        self.p2 = lp2
-
-        self.parent = parent            # Used for updating widths measurement
-        # Find slope of line (y2-y1)/(x2-x1)
-        self.m = (self.p2.y()-self.p1.y())/(self.p2.x()-self.p1.x())
-        self.assignPoints(self.m,lp1,lp2)
-        # Find X intercept
-        self.y0 = (lp1.y())-(self.m*lp1.x())  # y1-(m*x1) = b
-        self.x0 = (self.y0*-1)/self.m   # -y0/slope
-
-        # Set distance from linear measurement
-        d = np.sqrt((lp1.x()-lp2.x())**2 + (lp1.y()-lp2.y())**2)
-        t = (scaledSize*3)/d # Ratio of desired distance from center / total length of line
-
-        self.setPos(QtCore.QPointF(((1-t)*lp1.x()+t*lp2.x()),((1-t)*lp1.y()+t*lp2.y())))
+# Decoded crosshair/dot image, loaded from disk once per process
+@functools.cache
+def sprite_image(filename):
+    return QPixmap(resource_path(filename))
+
+# Process-wide cache of colored crosshair/dot pixmaps shared by every WidthItem
+# Keyed by (shape, scaled size, color, opacity), least recently used sprites are evicted
+@functools.lru_cache(maxsize=64)
+def crosshair_sprite(shape_type, scaledSize, rgba, opacity):
+    match shape_type:
+        case "Crosshair":
+            Image = sprite_image("crosshair.png").scaled(scaledSize,scaledSize)
+        case "Dot":
+            Image = sprite_image("dot.png").scaled(scaledSize,scaledSize)
+    color = QtGui.QColor.fromRgba(rgba)
+    color.setAlphaF(color.alphaF()*opacity/10)  # Opacity is baked into sprite
+    Pixmap = QPixmap(Image.size())
+    Pixmap.fill(color)
+    Pixmap.setMask(Image.createMaskFromColor(Qt.GlobalColor.transparent))
+    return Pixmap
+
+# Width QGraphicsItem Class
+# Draws every width line and handle of one width measurement in a single paint call
+# Handles are hit tested against measurement.handles in one vectorized pass and
+# dragged along their line, between the length curve and the image border
+class WidthItem(QGraphicsItem):
+    def __init__(self, view, measurement, scale, shape_type):
+        super(WidthItem, self).__init__()
+        self.view = view                # Used for recording drags and slider values
+        self.measurement = measurement  # Handle positions are read from and written back to measurement.handles
+        self.shape_key = shape_type     # Save user selected shape type
+        self.color = view.picked_color
+        self.sprite_key = None          # Key of sprite currently shown
+        self.pen = QtGui.QPen()
+        self.lines = [QLineF(*center, *end) for center, ends in zip(measurement.centers, measurement.ends) for end in ends]
+        self.dragged = None             # (index, side) of handle being dragged
+        self.hovered = False            # Cursor over a handle
+
+        P = np.concatenate((measurement.centers, measurement.ends.reshape(-1, 2)))
+        self.bounds = QtCore.QRectF(QtCore.QPointF(*P.min(axis = 0)), QtCore.QPointF(*P.max(axis = 0)))
+        self.update_crosshair(scale, view.opacity_pos)
         self.setAcceptHoverEvents(True)
-        self.drag = False
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)    # Paint only exposed handles
 
     def update_crosshair(self, scale, opacity):
         # scaledSize = int(self.parent.scene.height()/60) + (scale*10) # OLD WAY, just set to 50 pixel minimum for those hardcore low res users
         scaledSize = 10 + (scale*10)
-        match self.shape_key:
-            case "Crosshair":   # Save user selected shape type
-                Image = QPixmap(resource_path("crosshair.png")).scaled(scaledSize,scaledSize)
-            case "Dot":
-                Image = QPixmap(resource_path("dot.png")).scaled(scaledSize,scaledSize)
-        self.Pixmap = QPixmap(Image.size())
-        self.Pixmap.fill(self.color)
-        self.Pixmap.setMask(Image.createMaskFromColor(Qt.GlobalColor.transparent))
-
-        self.setPixmap(self.Pixmap)
-        self.setOffset(QtCore.QPointF(-scaledSize/2,-scaledSize/2)) # Set offset to center of image
-        self.setOpacity(opacity/10)
-
-    def assignPoints(self, slope, lp1, lp2):
-        # Set Points depending on their path slope 
-        if slope > -0.5 and slope < 0.5:    # Point assignmnet dependent on starting X values if slope is large
-            if lp1.x() < lp2.x():
-                self.p1 = lp1               # P1 should always hold the smaller comparetor
-                self.p2 = lp2
-            else:
-                self.p1 = lp2
-                self.p2 = lp1
-        else:                           
-            if lp1.y() < lp2.y():
-                self.p1 = lp1
-                self.p2 = lp2
-            else:
-                self.p1 = lp2
-                self.p2 = lp1
-
-    # Mouse Hover
-    def hoverEnterEvent(self, event):
-        QApplication.setOverrideCursor(QtCore.Qt.CursorShape.OpenHandCursor)
+        sprite_key = (self.shape_key, scaledSize, self.color.rgba(), opacity)
+        if sprite_key == self.sprite_key:   # Nothing changed since last update
+            return
+        self.prepareGeometryChange()
+        self.sprite_key = sprite_key
+        self.sprite = crosshair_sprite(*sprite_key)     # Shared with all handles of same style
+        self.half = scaledSize/2                        # Sprites are centered on handle position
+        self.update()
+
+    def boundingRect(self):
+        return self.bounds.adjusted(-self.half, -self.half, self.half, self.half)
+
+    def paint(self, painter, option, widget = None):
+        H = self.measurement.handles.reshape(-1, 2)
+        r = option.exposedRect
+        visible = ((H[:,0] > r.left() - self.half) & (H[:,0] < r.right() + self.half) &
+                   (H[:,1] > r.top() - self.half) & (H[:,1] < r.bottom() + self.half))
+        for x, y in H[visible]:     # Lines are drawn over handles
+            painter.drawPixmap(QtCore.QPointF(x - self.half, y - self.half), self.sprite)
+        painter.setPen(self.pen)
+        painter.drawLines(self.lines)
+
+    # (index, side) of handle under scene position pos, None if no handle is hit
+    # Where sprites of dense stations overlap, the handle nearest to pos wins
+    def handle_at(self, pos):
+        d = (self.measurement.handles - pos.toTuple()).reshape(-1, 2)
+        hit = np.flatnonzero((np.abs(d) <= self.half).all(axis = 1))
+        if len(hit) == 0:
+            return None
+        nearest = hit[np.argmin(np.einsum('ij,ij->i', d[hit], d[hit]))]
+        return divmod(int(nearest), 2)
+
+    # Position on line of handle (index, side) closest to pos
+    # Follows x when line is closer to horizontal and y when closer to vertical
+    def constrain(self, index, side, pos):
+        center = self.measurement.centers[index]
+        d = self.measurement.ends[index, side] - center
+        axis = 0 if abs(d[1]) < 0.5*abs(d[0]) else 1
+        t = min(max((pos[axis] - center[axis])/d[axis], 0.0), 1.0)
+        return center + t*d
+
+    # Rect covered by sprite of handle (index, side)
+    def handle_rect(self, index, side):
+        x, y = self.measurement.handles[index, side]
+        return QtCore.QRectF(x - self.half, y - self.half, 2*self.half, 2*self.half)
+
+    # Mouse Hover, cursor shows a hand over handles only
+    def hoverMoveEvent(self, event):
+        hovered = self.handle_at(event.scenePos()) is not None
+        if hovered != self.hovered:
+            self.hovered = hovered
+            QApplication.setOverrideCursor(QtCore.Qt.CursorShape.OpenHandCursor if hovered else QtCore.Qt.CursorShape.ArrowCursor)
 
     # Mouse Stops Hovering
     def hoverLeaveEvent(self, event):
-        QApplication.setOverrideCursor(QtCore.Qt.CursorShape.ArrowCursor)
+        if self.hovered:
+            self.hovered = False
+            QApplication.setOverrideCursor(QtCore.Qt.CursorShape.ArrowCursor)
 
     def mousePressEvent(self, event):
-        self.drag = True
+        self.dragged = self.handle_at(event.scenePos())
+        if self.dragged is None:    # Clicks between handles go to items below
+            event.ignore()
+            return
+        self.drag_start = tuple(self.measurement.handles[self.dragged])    # Recorded as one undo step on release
         QApplication.setOverrideCursor(QtCore.Qt.CursorShape.BlankCursor)
 
+    @timed("drag_handle")
     def mouseMoveEvent(self, event):
-        if self.drag:
-            orig_curs_pos = event.lastScenePos()
-            updated_curs_pos = event.scenePos()
-            orig_pos = self.scenePos()
-
-            # Update position of Ellipse to match mouse
-
-            ell_y = updated_curs_pos.y()# - orig_curs_pos.y() + orig_pos.y()
-            ell_x = updated_curs_pos.x()# - orig_curs_pos.x() + orig_pos.x()
-
-            # Use X of mouse when line is horizontal, and Y when verticle
-            if self.m > -0.5 and self.m < 0.5:
-                # y = mx + b
-                if ell_x < self.p1.x():
-                    ell_x = self.p1.x()
-                elif ell_x > self.p2.x():
-                    ell_x = self.p2.x()
-                ell_y = ell_x*self.m + self.y0
-                
-            else:
-                # x = y/m - r
-                # Stay within boundry
-                if ell_y < self.p1.y():
-                    ell_y = self.p1.y()
-                elif ell_y > self.p2.y():
-                    ell_y = self.p2.y()
-
-                ell_x = ell_y/self.m + self.x0
-                
-            self.setPos(QtCore.QPointF(ell_x, ell_y))
+        if self.dragged is not None:
+            dirty = self.handle_rect(*self.dragged)
+            self.measurement.handles[self.dragged] = self.constrain(*self.dragged, event.scenePos().toTuple())
+            self.update(dirty.united(self.handle_rect(*self.dragged)))
 
     def mouseReleaseEvent(self, event):
-        self.drag = False
-        QApplication.setOverrideCursor(QtCore.Qt.CursorShape.ArrowCursor)
-
-# Calculate bezier function for line fitment
-def bezier(t,P,k,arc = False):
-    """
-    Matrix representation of Bezier curve following
-    https://pomax.github.io/bezierinfo/#arclength
-    """
-    signs = np.array([i for j,i in zip(range(k+1),islice(cycle([1, -1]),0,None))]) #create array alternating 0,1s for diagonals
-    A = pascal(k+1, kind='lower') #generate Pascal triangle matrix
-    S = diags(signs, [i-k for i in range(k+1)][::-1], shape=(k+1, k+1)).toarray() #create signs matrix
-    M = A*S #multiply pascals by signs to get Bernoulli polynomial matrix
-    coeff = A[-1,:]
-    C = M*coeff[:,None] #broadcast
-    T = np.array( [t**i for i in range(k+1)] ).T
-
-    B = T.dot( C.dot(P) )
-
-    if arc:
-        return np.linalg.norm(B, axis = 1)
-    else:
-        return B
-
-# Gauss-Legendre Quadrature for bezier curve arc length
-def gauss_legendre(b, f, P, k, arc, loc = 0.0, L = 1, degree = 24, a = 0):
-    x, w = np.polynomial.legendre.leggauss(degree)
-    t = 0.5*(b-a)*x + 0.5*(b+a)
-
-    return 0.5*(b-a)*np.sum( w*bezier(t,P,k,arc) )/L - loc
-
-# Class to hold measurement of objects and current states for prcedural QGraphicScene
-class Measurement():
-
-    def __init__(self, mt, name):
-        self.measurement_type = mt
-        self.measurement_name = name
-        self.objects_params = []
-        self.measurement_value = None
-
-        # Items used by width measurement
-        self.Q = None
-        self.kb = None
-        self.l = None
-        self.P = None
-
-    # Return dict containing state of scene at time of measurement
-    def get_type(self):
-        return self.measurement_type
-    
-    # Return list of Qt objects stored
-    def get_objects(self):
-        return self.objects_params
-    
-    # Return name of measurement
-    def get_name(self):
-        return self.measurement_name
-    
-    # Append Qt object to measurement class
-    def append_object(self, object):
-        self.objects_params.append(object)  # Create deepcopy
-
-    # Remove top object
-    def rem_object(self):
-        self.objects_params.pop()
-
-    # Return True/False if class holds objects
-    def has_objects(self):
-        if len(self.objects_params) > 0:
-            return True
-        return False
-        
-# Custom class to hold position data of QPoint
-class posData():
-
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-
-    def update(self, add_x, add_y):
-        self.x = np.append(self.x, add_x)
-        self.y = np.append(self.y, add_y)
+        if self.dragged is not None:
+            index, side = self.dragged
+            position = tuple(self.measurement.handles[index, side])
+            if position != self.drag_start:
+                self.view.record([MoveHandle(self.measurement, index, side, self.drag_start, position)], self.view.measuring_state)
+                self.view.update_application()    # Redo is no longer available
+            self.dragged = None
+            QApplication.setOverrideCursor(QtCore.Qt.CursorShape.ArrowCursor)
 
-        #below just for area calcs
-        self.dx = np.diff(self.x)
-        self.dy = np.diff(self.y)
-        self.Tu = np.hypot(self.dx,self.dy) + np.finfo(float).eps
\ No newline at end of file
+# Curve QGraphicsItem Class
+# Draws a fitted length curve as a single polyline
+# Sampling density follows the view zoom so the chord error stays below TOLERANCE screen pixels
+class CurveItem(QGraphicsItem):
+    TOLERANCE = 0.25        # Max screen space deviation from true curve (pixels)
+    MIN_SEGMENTS = 8
+    MAX_SEGMENTS = 4096
+
+    def __init__(self, curve):
+        super(CurveItem, self).__init__()
+        self.curve = curve
+        self.pen = QtGui.QPen()
+        self.samples = {}           # Sampled polylines keyed by segment count
+
+        t, _ = curve.arc_length_table
+        B = curve.evaluate(t)
+        self.bounds = QtCore.QRectF(QtCore.QPointF(*B.min(axis = 0)), QtCore.QPointF(*B.max(axis = 0))).adjusted(-1,-1,1,1)
+        self.max_accel = np.linalg.norm(curve.second_derivative(t), axis = 1).max()    # Bound on |B''(t)|
+
+    # Segments needed at view scale, chord error of a segment is at most |B''| * dt^2 / 8
+    def segments(self, scale):
+        if self.max_accel * scale <= 0:
+            return self.MIN_SEGMENTS
+        n = int(np.ceil(1 / np.sqrt(8 * self.TOLERANCE / (self.max_accel * scale))))
+        n = 1 << max(n - 1, 1).bit_length()     # Round up to power of 2 so nearby zoom levels share samples
+        return min(max(n, self.MIN_SEGMENTS), self.MAX_SEGMENTS)
+
+    # Polyline of curve with n segments, sampled once per n
+    def polyline(self, n):
+        if n not in self.samples:
+            B = self.curve.evaluate(np.linspace(0.0, 1.0, n + 1))
+            self.samples[n] = QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in B])
+        return self.samples[n]
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget = None):
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        painter.setPen(self.pen)
+        painter.drawPolyline(self.polyline(self.segments(scale)))
+
+# Graphics items of one measurement (Retained mode)
+# Items are built once and only touched when their measurement changes
+class MeasurementItems():
+    def __init__(self, view, measurement):
+        self.view = view
+        self.measurement = measurement
+        self.revision = None                # Measurement revision items were last synced to
+        self.lines = []                     # QGraphicsLineItem of every placed line
+        self.shape = (None, None, None)     # (curve, polygon, centers) shape items were built from
+        self.items = []                     # Curve, polygon and width items
+        self.widths = None                  # WidthItem of width lines and handles
+
+    # Update items to match measurement
+    def sync(self):
+        measurement = self.measurement
+        if measurement.revision == self.revision:
+            return
+        self.revision = measurement.revision
+        self.sync_lines()
+        shape = (measurement.curve, measurement.polygon, measurement.centers)
+        if any(a is not b for a, b in zip(shape, self.shape)):
+            self.shape = shape
+            self.build_shape()
+        if self.widths is not None:     # Handles moved by undo/redo
+            self.widths.update()
+
+    # Placed points only ever change at the end, so only trailing lines are removed/added
+    def sync_lines(self):
+        V = self.measurement.points.array
+        count = max(len(V) - 1, 0) if self.measurement.curve is None else 0    # Fitted curve replaces placed lines
+        while self.lines and (len(self.lines) > count or self.lines[-1].line() != QLineF(*V[len(self.lines)-1], *V[len(self.lines)])):
+            self.remove_item(self.lines.pop())
+        while len(self.lines) < count:
+            k = len(self.lines)
+            self.lines.append(self.add_item(QGraphicsLineItem(QLineF(*V[k], *V[k+1]))))
+
+    # Rebuild curve, polygon and width items
+    def build_shape(self):
+        for item in self.items:
+            self.remove_item(item)
+        self.items = []
+        self.widths = None
+        measurement = self.measurement
+        if measurement.curve is not None:
+            self.items.append(self.add_item(CurveItem(measurement.curve)))
+        if measurement.polygon is not None:
+            polygon = QGraphicsPolygonItem(to_qpolygon(measurement.polygon))
+            polygon.setBrush(QtGui.QBrush(QtGui.QColor(255,255,255,127)))
+            self.items.append(self.add_item(polygon))
+        if measurement.centers is not None and len(measurement.centers) > 0:
+            self.build_widths()
+
+    # Side labels, then one item drawing all width lines and handles
+    def build_widths(self):
+        view = self.view
+        measurement = self.measurement
+        start = QtCore.QPointF(*measurement.centers[0])
+        for l, end in enumerate(measurement.ends[0]):   # Labels sit on first width line
+            end = QtCore.QPointF(*end)
+            # Set distance from linear measurement
+            lineLength = np.sqrt((start.x()-end.x())**2 + (start.y()-end.y())**2)
+            t = (500)/lineLength # Ratio of desired distance from center / total length of line
+            posAB = QtCore.QPointF(((1-t)*start.x()+t*end.x()),((1-t)*start.y()+t*end.y()))
+            font = QFont()
+            font.setPointSize(40)
+            font.setWeight(QFont.Weight.Bold)
+            font.setPixelSize(int(view.image_item.width()/30))  # Set text size relative to image dimensions
+            textItem = QGraphicsTextItem("AB"[l])
+            textItem.setFont(font)
+            textItem.setPos(posAB)
+            self.items.append(self.add_item(textItem))
+
+        self.widths = WidthItem(view, measurement, view.slider_pos, view.parent().subWin.width_tabs.currentText())
+        self.items.append(self.add_item(self.widths))
+
+    def add_item(self, item):
+        self.view.scene.addItem(item)
+        return item
+
+    def remove_item(self, item):
+        if item.scene() is not None:
+            item.scene().removeItem(item)
+
+    # Remove all items of measurement from scene
+    def remove(self):
+        for item in self.lines + self.items:
+            self.remove_item(item)
+        self.lines = []
+        self.items = []
+        self.widths = None
+
+# Convert (N,2) vertex array to QPolygonF for drawing
+def to_qpolygon(V):
+    return QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in V])
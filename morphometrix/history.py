@@ -0,0 +1,136 @@
+from collections import deque
+
+# ------------------------------
+#   MorphoMetrix Undo History
+#   Every edit of the measurement stack is recorded as a small command holding only what it changed
+#   Undo/redo reapply that change to its one measurement, independent of how many are on the stack
+# ------------------------------
+
+HISTORY_LIMIT = 1000    # Undo steps kept, oldest are dropped
+
+# Measurement appended to end of stack (width placement included, its stations are kept with it)
+class AddMeasurement():
+    def __init__(self, measurement):
+        self.measurement = measurement
+
+    # Returns True if measurement is on stack afterwards
+    def undo(self, measurement_stack):
+        measurement_stack.pop()
+        return False
+
+    def redo(self, measurement_stack):
+        measurement_stack.append(self.measurement)
+        return True
+
+# Points placed at end of measurement
+class AddPoints():
+    def __init__(self, measurement, points):
+        self.measurement = measurement
+        self.points = [tuple(p) for p in points]
+
+    def undo(self, measurement_stack):
+        for _ in self.points:
+            self.measurement.pop_point()
+        return True
+
+    def redo(self, measurement_stack):
+        for x, y in self.points:
+            self.measurement.add_point(x, y)
+        return True
+
+# Measurement finished: curve fitted, polygon closed, length or angle calculated
+# Holds (curve, polygon, value) before and after
+class Finish():
+    FIELDS = ("curve", "polygon", "measurement_value")
+
+    def __init__(self, measurement, before):
+        self.measurement = measurement
+        self.before = before
+        self.after = Finish.state(measurement)
+
+    @staticmethod
+    def state(measurement):
+        return tuple(getattr(measurement, field) for field in Finish.FIELDS)
+
+    def apply(self, state):
+        for field, value in zip(self.FIELDS, state):
+            setattr(self.measurement, field, value)
+        self.measurement.revision += 1
+
+    def undo(self, measurement_stack):
+        self.apply(self.before)
+        return True
+
+    def redo(self, measurement_stack):
+        self.apply(self.after)
+        return True
+
+# Width handle dragged along its line
+class MoveHandle():
+    def __init__(self, measurement, index, side, before, after):
+        self.measurement = measurement
+        self.index = index
+        self.side = side
+        self.before = tuple(before)
+        self.after = tuple(after)
+
+    def apply(self, position):
+        self.measurement.handles[self.index, self.side] = position
+        self.measurement.revision += 1
+
+    def undo(self, measurement_stack):
+        self.apply(self.before)
+        return True
+
+    def redo(self, measurement_stack):
+        self.apply(self.after)
+        return True
+
+class History():
+    """
+    Bounded undo/redo history of the measurement stack.
+    A step is the commands of one user action with the measuring state before and after it.
+    Recording a new step drops the redo steps.
+    """
+
+    def __init__(self, limit = HISTORY_LIMIT):
+        self.undo_steps = deque(maxlen = limit)
+        self.redo_steps = []
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+
+    def can_undo(self):
+        return len(self.undo_steps) > 0
+
+    def can_redo(self):
+        return len(self.redo_steps) > 0
+
+    def record(self, commands, state_before, state_after):
+        self.undo_steps.append((commands, state_before, state_after))
+        self.redo_steps.clear()
+
+    # Record step done before history started (measurements loaded from a project), redo steps are kept
+    def assume(self, commands, state_before, state_after):
+        self.undo_steps.append((commands, state_before, state_after))
+
+    # Undo last step, returns ([(measurement, on stack)], measuring state) or None if nothing to undo
+    def undo(self, measurement_stack):
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        commands, state_before, _ = step
+        changed = [(command.measurement, command.undo(measurement_stack)) for command in reversed(commands)]
+        self.redo_steps.append(step)
+        return changed, state_before
+
+    # Redo last undone step, same return as undo
+    def redo(self, measurement_stack):
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        commands, _, state_after = step
+        changed = [(command.measurement, command.redo(measurement_stack)) for command in commands]
+        self.undo_steps.append(step)
+        return changed, state_after
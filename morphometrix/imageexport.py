@@ -0,0 +1,117 @@
+from PySide6.QtWidgets import QGraphicsLineItem, QGraphicsPolygonItem, QGraphicsTextItem
+from PySide6.QtGui import QImage, QImageWriter, QPainter, QPen, QBrush
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QCoreApplication, QRectF, QPointF, Qt, Signal
+from graphicsview import CurveItem, WidthItem
+
+# ------------------------------
+#   MorphoMetrix Image Export
+#   Annotated image at native (or chosen) resolution, painted and encoded on a worker thread
+#   Scene items are only read on the GUI thread, the worker gets value copies of their geometry
+# ------------------------------
+
+EXPORT_FORMATS = {"PNG": "png", "JPEG": "jpg"}
+
+# Copy what every measurement item draws, in scene (full resolution image) coordinates
+# Must run on GUI thread, returns list of (kind, geometry...) drawn in order by paint_overlay
+def overlay_snapshot(view, scale):
+    overlay = []
+    for measurement in view.measurement_stack:
+        layer = view.layers.get(measurement)
+        if layer is None:
+            continue
+        for item in layer.lines + layer.items:
+            if isinstance(item, QGraphicsLineItem):
+                overlay.append(("line", QPen(item.pen()), item.line()))
+            elif isinstance(item, QGraphicsPolygonItem):
+                overlay.append(("polygon", QPen(item.pen()), QBrush(item.brush()), item.polygon()))
+            elif isinstance(item, QGraphicsTextItem):
+                overlay.append(("text", item.font(), item.pos(), item.toPlainText(), item.document().documentMargin()))
+            elif isinstance(item, WidthItem):   # Handles, then lines drawn over them
+                sprite = item.sprite.toImage()
+                overlay.extend(("sprite", sprite, QPointF(x - item.half, y - item.half)) for x, y in item.measurement.handles.reshape(-1, 2))
+                overlay.extend(("line", QPen(item.pen), line) for line in item.lines)
+            elif isinstance(item, CurveItem):   # Sampled for export scale
+                overlay.append(("polyline", QPen(item.pen), item.polyline(item.segments(scale))))
+    return overlay
+
+# Paint overlay from overlay_snapshot, painter is in scene coordinates
+def paint_overlay(painter, overlay):
+    for kind, *args in overlay:
+        match kind:
+            case "line":
+                pen, line = args
+                painter.setPen(pen)
+                painter.drawLine(line)
+            case "polyline":
+                pen, polyline = args
+                painter.setPen(pen)
+                painter.drawPolyline(polyline)
+            case "polygon":
+                pen, brush, polygon = args
+                painter.setPen(pen)
+                painter.setBrush(brush)
+                painter.drawPolygon(polygon)
+                painter.setBrush(Qt.BrushStyle.NoBrush)
+            case "text":
+                font, pos, text, margin = args
+                painter.setPen(QPen())
+                painter.setFont(font)
+                painter.drawText(QRectF(pos + QPointF(margin, margin), pos + QPointF(1e6, 1e6)),
+                                 Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, text)
+            case "sprite":
+                image, pos = args
+                painter.drawImage(pos, image)
+
+# Paints base image and overlay onto a new image scaled by scale, then encodes it
+# Only QImage/QPainter are used, both are safe off the GUI thread
+class ExportTask(QRunnable):
+    def __init__(self, signals, path, base, size, overlay, scale, quality):
+        super(ExportTask, self).__init__()
+        self.signals = signals
+        self.path = path
+        self.base = base            # Background QImage, any pyramid level
+        self.size = size            # Full resolution image (width, height)
+        self.overlay = overlay
+        self.scale = scale
+        self.quality = quality      # 0-100, JPEG quality or inverse PNG compression level
+
+    def run(self):
+        try:
+            width, height = self.size
+            image = QImage(max(1, round(width*self.scale)), max(1, round(height*self.scale)), QImage.Format.Format_RGB32)
+            painter = QPainter(image)
+            if self.base.width() != image.width():
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(QRectF(image.rect()), self.base)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, False)
+            painter.scale(self.scale, self.scale)
+            paint_overlay(painter, self.overlay)
+            painter.end()
+
+            writer = QImageWriter(self.path)
+            writer.setQuality(self.quality)
+            if not writer.write(image):
+                raise IOError(writer.errorString())
+        except Exception as e:
+            self.signals.finished.emit(self.path, str(e))
+        else:
+            self.signals.finished.emit(self.path, "")
+
+class ImageExporter(QObject):
+    finished = Signal(str, str)     # Path and error ("" on success), delivered on GUI thread
+
+    def __init__(self):
+        super(ImageExporter, self).__init__()
+        QCoreApplication.instance().aboutToQuit.connect(self.wait)     # However the app is closed, exports are written
+    # Start export of view's image and measurements to path, returns immediately
+    # Format follows path extension, scale 1 is native image resolution
+    def export(self, view, path, scale = 1.0, quality = 90):
+        pyramid = view.image_item.pyramid
+        k = min(pyramid.level_for_scale(scale), len(pyramid.levels) - 1)     # Smallest already built level with enough detail
+        task = ExportTask(self, path, pyramid.levels[k], (pyramid.width(), pyramid.height()),
+                          overlay_snapshot(view, scale), scale, quality)
+        QThreadPool.globalInstance().start(task)
+
+    # Block until running exports are written
+    def wait(self):
+        QThreadPool.globalInstance().waitForDone()
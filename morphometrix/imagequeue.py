@@ -0,0 +1,139 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QCoreApplication, Signal
+from tiledimage import ImagePyramid, read_image
+from collections import OrderedDict
+import os
+
+# ------------------------------
+#   MorphoMetrix Image Queue
+#   Steps through the images of a folder, decoding the K images on either side
+#   of the current one on worker threads
+# ------------------------------
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+PREFETCH = 2                    # Images decoded ahead and behind current image
+QUEUE_BYTES = 2 << 30           # Memory budget of decoded images
+
+# Decodes one image and builds its pyramid on a pool thread
+# QImage is safe to use off the GUI thread, pixmaps are only made from it once shown
+# The queue owns the task until its decoded signal is handled, the pool must not delete it
+# on return from run() while the signal is still queued (tryTake on it would then raise)
+class DecodeTask(QRunnable):
+    def __init__(self, queue, path):
+        super(DecodeTask, self).__init__()
+        self.setAutoDelete(False)
+        self.queue = queue
+        self.path = path
+
+    def run(self):
+        try:
+            pyramid = ImagePyramid(read_image(self.path)).build()
+        except Exception as e:
+            self.queue.decoded.emit(self, None, str(e))
+        else:
+            self.queue.decoded.emit(self, pyramid, "")
+
+class ImageQueue(QObject):
+    ready = Signal(str, object)     # Path and ImagePyramid of image to show
+    failed = Signal(str, str)       # Path and error of image that could not be decoded
+    decoded = Signal(object, object, str)  # DecodeTask, pyramid and error, delivered on GUI thread
+
+    def __init__(self, prefetch = PREFETCH, budget = QUEUE_BYTES):
+        super(ImageQueue, self).__init__()
+        self.prefetch = prefetch
+        self.budget = budget
+        self.paths = []
+        self.position = {}              # path -> index in queue
+        self.index = -1
+        self.frames = OrderedDict()     # path -> decoded ImagePyramid
+        self.pending = {}               # path -> DecodeTask queued or running
+        self.tasks = set()              # Every DecodeTask started and not yet handled, kept alive here
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.decoded.connect(self.on_decoded)
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+
+    def __len__(self):
+        return len(self.paths)
+
+    # Queue every image of folder, sorted by name, returns number of images
+    def open(self, folder):
+        self.close()
+        self.paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.position = {path: i for i, path in enumerate(self.paths)}
+        return len(self.paths)
+
+    # End folder session (another image or project opened), decodes still running are ignored once done
+    def close(self):
+        for task in self.pending.values():     # Queued decodes of this folder
+            if self.pool.tryTake(task):
+                self.tasks.discard(task)
+        self.paths = []
+        self.position = {}
+        self.frames.clear()
+        self.pending.clear()
+        self.index = -1
+
+    # Drop queued decodes and wait for running ones, before queue is deleted
+    def stop(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.pending.clear()
+        self.tasks.clear()
+
+    def current(self):
+        return self.paths[self.index] if 0 <= self.index < len(self.paths) else None
+
+    # Move by delta images, returns False at either end of queue
+    def step(self, delta):
+        index = self.index + delta
+        if not 0 <= index < len(self.paths):
+            return False
+        self.show(index)
+        return True
+
+    # Make image at index current, ready is emitted now if it is decoded or else once it is
+    def show(self, index):
+        self.index = index
+        path = self.paths[index]
+        for other, task in list(self.pending.items()):     # Drop queued decodes left behind by fast stepping
+            if abs(self.position[other] - index) > self.prefetch and self.pool.tryTake(task):
+                del self.pending[other]
+                self.tasks.discard(task)
+        if path in self.frames:
+            self.frames.move_to_end(path)
+            self.ready.emit(path, self.frames[path])
+        else:
+            self.decode(path, priority = 1)
+        for d in range(1, self.prefetch + 1):   # Nearest neighbors first
+            for i in (index + d, index - d):
+                if 0 <= i < len(self.paths):
+                    self.decode(self.paths[i])
+
+    def decode(self, path, priority = 0):
+        if path not in self.frames and path not in self.pending:
+            self.pending[path] = DecodeTask(self, path)
+            self.tasks.add(self.pending[path])
+            self.pool.start(self.pending[path], priority)
+
+    def on_decoded(self, task, pyramid, error):
+        self.tasks.discard(task)
+        path = task.path
+        if self.pending.get(path) is not task:  # Folder changed or closed while decoding
+            return
+        del self.pending[path]
+        if pyramid is None:
+            if path == self.current():
+                self.failed.emit(path, error)
+            return
+        self.frames[path] = pyramid
+        self.evict()
+        if path == self.current():
+            self.ready.emit(path, pyramid)
+
+    # Drop decoded images farthest from current image until within budget
+    def evict(self):
+        total = sum(pyramid.nbytes() for pyramid in self.frames.values())
+        for path in sorted(self.frames, key = lambda p: abs(self.position[p] - self.index), reverse = True):
+            if total <= self.budget or path == self.current():
+                break
+            total -= self.frames.pop(path).nbytes()
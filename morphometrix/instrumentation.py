@@ -0,0 +1,72 @@
+import os, json, time, threading, functools
+from collections import deque
+import numpy as np
+
+# ------------------------------
+#   MorphoMetrix Instrumentation
+#   Opt-in latency timing of GUI handlers, off unless MORPHOMETRIX_PROFILE is set or toggled (Ctrl+Shift+P)
+#   Keeps rolling p50/p95/max per handler and a Chrome trace (chrome://tracing, ui.perfetto.dev) of the session
+# ------------------------------
+
+PROFILE_VARIABLE = "MORPHOMETRIX_PROFILE"   # Set to 1 to start profiling at launch
+WINDOW = 256                    # Latest latencies kept per handler for percentiles
+TRACE_EVENTS = 1 << 20          # Trace events kept per session, oldest are dropped
+
+class Instrumentation():
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.latencies = {}                             # name -> deque of latest durations (ms)
+        self.trace = deque(maxlen = TRACE_EVENTS)       # Chrome trace complete events
+        self.origin = time.perf_counter()
+
+    # Record one call of name that ran from start to end (perf_counter seconds)
+    def record(self, name, start, end):
+        if name not in self.latencies:
+            self.latencies[name] = deque(maxlen = WINDOW)
+        self.latencies[name].append((end - start)*1e3)
+        self.trace.append((name, start, end, threading.get_ident()))
+
+    def clear(self):
+        self.latencies.clear()
+        self.trace.clear()
+
+    # {name: (p50, p95, max, calls in window)} of latest latencies, in ms
+    def stats(self):
+        stats = {}
+        for name, latencies in self.latencies.items():
+            p50, p95 = np.percentile(latencies, (50, 95))
+            stats[name] = (p50, p95, max(latencies), len(latencies))
+        return stats
+
+    # One line summary for status bar, slowest handler (by p95) first
+    def summary(self):
+        stats = sorted(self.stats().items(), key = lambda item: item[1][1], reverse = True)
+        return "  ".join("%s %.1f/%.1f/%.1f" % (name, p50, p95, peak) for name, (p50, p95, peak, n) in stats)
+
+    # Write session trace as Chrome trace JSON, returns number of events written
+    def write_trace(self, path, metadata = None):
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                   "ts": (start - self.origin)*1e6, "dur": (end - start)*1e6}
+                  for name, start, end, tid in list(self.trace)]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": metadata or {}}, f)
+        return len(events)
+
+profiler = Instrumentation(os.environ.get(PROFILE_VARIABLE, "") not in ("", "0"))
+
+# Decorator timing every call of function as name while profiler is enabled
+# Disabled cost is one attribute check per call
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter())
+        return wrapper
+    return decorator
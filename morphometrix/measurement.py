@@ -0,0 +1,210 @@
+from geometry import BezierCurve, SplineCurve, SegmentGrid, PointBuffer, clip_lines_to_box, strongest_edges, segment_intersections, polygon_area, polyline_length, angle_between
+import numpy as np
+import types
+
+# ------------------------------
+#   MorphoMetrix Measurement Model
+#   Geometry of every measurement in image pixel space, kept free of Qt
+#   Graphics items are built from it by graphicsview
+# ------------------------------
+
+consts = types.SimpleNamespace()
+# State case constants
+consts.LENGTH = 1
+consts.AREA = 2
+consts.ANGLE = 3
+consts.WIDTH = 4
+
+# Side bias constants
+consts.SIDE_A = 0
+consts.SIDE_B = 1
+
+# Class to hold measurement geometry and value
+class Measurement():
+    __slots__ = ("measurement_type", "measurement_name", "measurement_value", "points", "curve",
+                 "polygon", "edge_index", "centers", "ends", "handles", "revision")
+
+    GRID_CELL = 32      # Cell size (pixels) of area edge index
+
+    def __init__(self, mt, name):
+        self.measurement_type = mt
+        self.measurement_name = name
+        self.measurement_value = None
+        self.points = PointBuffer()         # Placed points (length, area, angle)
+        self.revision = 0                   # Incremented on every change, used to sync graphics
+
+        # Items used by length measurement
+        self.curve = None                   # Fitted BezierCurve/SplineCurve
+
+        # Items used by area measurement
+        self.polygon = None                 # (N,2) vertices of closed polygon
+        self.edge_index = None              # SegmentGrid of placed lines
+
+        # Items used by width measurement
+        self.centers = None                 # (N,2) stations on length curve
+        self.ends = None                    # (N,2,2) image border points of width lines, side A then side B
+        self.handles = None                 # (N,2,2) handle positions, side A then side B
+
+    # Return measurement type
+    def get_type(self):
+        return self.measurement_type
+
+    # Return name of measurement
+    def get_name(self):
+        return self.measurement_name
+
+    # Return True/False if measurement holds placed points
+    def has_points(self):
+        return len(self.points) > 0
+
+    # Return last placed point
+    def last_point(self):
+        return self.points.array[-1]
+
+    # Place point, area measurements also index the new line
+    def add_point(self, x, y):
+        self.points.append(x, y)
+        if self.measurement_type == consts.AREA and len(self.points) > 1:
+            if self.edge_index is None:
+                self.edge_index = SegmentGrid(self.GRID_CELL)
+            self.edge_index.append(self.points.array[-2], self.points.array[-1])
+        self.revision += 1
+
+    # Remove last placed point, measurement is no longer finished
+    def pop_point(self):
+        self.points.pop()
+        if self.edge_index is not None and len(self.edge_index) > max(len(self.points) - 1, 0):
+            self.edge_index.pop()
+        self.measurement_value = None
+        self.revision += 1
+
+    # Fit curve through placed points
+    def fit_curve(self, spline = False):
+        P = self.points.array.copy() #control points
+        # Every click at one point (double click on first point) has no spline, Bezier gives zero length
+        if spline and len(np.unique(P, axis = 0)) > 1:
+            self.curve = SplineCurve(P)     # Linear cost, stable for many points
+        else:
+            self.curve = BezierCurve(P)
+        self.measurement_value = self.curve.length #compute total arc length.
+        self.revision += 1
+
+    # Calculate total length of piecewise length measurement
+    def calculate_length(self):
+        self.measurement_value = polyline_length(self.points.array)
+
+    # Calculate angle (degrees) between the two lines of a finished angle measurement
+    def calculate_angle(self):
+        A, B, C = self.points.array[:3]
+        self.measurement_value = angle_between(B - A, C - B)
+
+    # Checks if line from last placed point to cursor intersects any placed line but its neighbor
+    # Returns candidate area polygon as (N,2) array, or None if no intersection
+    def intersect_polygon(self, cursor):
+        n = len(self.points)
+        if n > 2:   # Check if more than 2 lines exist
+            last = self.last_point()
+            # Only test lines near cursor line, in order of placement
+            candidates = [i for i in self.edge_index.query(last, cursor) if i < n - 2]
+            if candidates:
+                V = self.points.array
+                hit, X = segment_intersections(last, cursor, V[candidates], V[np.add(candidates, 1)])
+                if hit.any():
+                    first = np.argmax(hit)
+                    i = candidates[first]
+                    return np.vstack((V[i+1:], [cursor, X[first]]))   # Add cursor and intersection point
+        return None
+
+    # Close area measurement with polygon from intersect_polygon
+    def close_polygon(self, polygon):
+        self.polygon = polygon
+        self.measurement_value = polygon_area(polygon)
+        self.revision += 1
+
+    # Remove closed polygon, placed points are kept
+    def reopen_polygon(self):
+        self.polygon = None
+        self.measurement_value = None
+        self.revision += 1
+
+    # Place width stations evenly along arc length of a fitted length measurement
+    # Lines run along the curve normal to the image border (L x H), handles start offset pixels from center
+    def place_widths(self, length, numwidths, L, H, offset):
+        curve = length.curve
+        s_i = np.linspace(0,1,numwidths+2)[1:-1]    #only need to draw widths for inner pts
+        t_i = curve.inverse_arc_length(s_i*curve.length)     #solve all stations in one batch
+        B_i = curve.evaluate(t_i)
+
+        #Find normal vectors by applying pi/2 rotation matrix to tangent vector
+        bdot = curve.derivative(t_i)
+        mag = np.linalg.norm(bdot,axis = 1) #normal vector magnitude
+        bnorm = np.flip(bdot/mag[:,None],axis = 1)
+        bnorm[:,0] *= -1
+
+        #Find where every normal leaves the image, skip stations outside of image
+        ends = clip_lines_to_box(B_i, bnorm, L, H)
+        inside = ~np.isnan(ends).any(axis = (1,2))
+        self.centers = B_i[inside]
+        self.ends = ends[inside]
+
+        d = np.linalg.norm(self.ends - self.centers[:,None,:], axis = -1)
+        t = offset/d    # Ratio of desired distance from center / total length of line
+        self.handles = self.centers[:,None,:] + t[...,None]*(self.ends - self.centers[:,None,:])
+        self.revision += 1
+
+    # Move every handle to the strongest edge along its width line, image is (H,W) luminance
+    def snap_widths(self, image):
+        self.handles = strongest_edges(image, self.centers, self.ends, self.handles)     # Handles without an edge stay put
+        self.revision += 1
+
+    # Calculates distance in pixels of width handles for selected mirror side
+    def calculate_widths(self, bias):
+        match bias:
+            case "Side A":
+                width_array = np.linalg.norm(self.handles[:,consts.SIDE_A] - self.centers, axis = 1)
+            case "Side B":
+                width_array = np.linalg.norm(self.handles[:,consts.SIDE_B] - self.centers, axis = 1)
+            case _: # None
+                width_array = np.linalg.norm(self.handles[:,consts.SIDE_A] - self.handles[:,consts.SIDE_B], axis = 1)
+        self.measurement_value = width_array.tolist()    # Calculated in pixels
+
+# Rows of the metadata block heading every exported csv
+def metadata_rows(image_id, image_path, focal, altitude, pixeldim, side, notes):
+    return [["Object","Value","Value_unit"],
+            ['Image ID',image_id,"Metadata"],
+            ['Image Path',image_path,"Metadata"],
+            ['Focal Length', focal,"Metadata"],
+            ['Altitude', altitude,"Metadata"],
+            ['Pixel Dimension', pixeldim,"Metadata"],
+            ['Mirror Side', side, "Metadata"],
+            ['Notes', notes, "Metadata"]]
+
+TYPE_NAMES = {consts.LENGTH: "length", consts.AREA: "area", consts.ANGLE: "angle", consts.WIDTH: "width"}
+
+# Full precision value of every measurement in stack, in units of m meters per pixel
+# Yields (name, type name, width station % or None, value in pixels, value in units, unit)
+def measurement_records(measurement_stack, m):
+    for measurement in measurement_stack:
+        name, mt = measurement.get_name(), measurement.get_type()
+        match mt:
+            case consts.WIDTH:
+                num_widths = len(measurement.measurement_value)
+                for i, value in enumerate(measurement.measurement_value):
+                    yield name, TYPE_NAMES[mt], (i+1)/(num_widths+1)*100, value, value*m, "Meters"
+            case consts.LENGTH:
+                yield name, TYPE_NAMES[mt], None, measurement.measurement_value, measurement.measurement_value*m, "Meters"
+            case consts.ANGLE:
+                yield name, TYPE_NAMES[mt], None, measurement.measurement_value, measurement.measurement_value, "Degrees"
+            case consts.AREA:
+                yield name, TYPE_NAMES[mt], None, measurement.measurement_value, measurement.measurement_value*(m**2), "Square Meters"
+
+# Rows of every measurement in stack, in pixels and in units of m meters per pixel
+def measurement_rows(measurement_stack, m):
+    pixel_measurement = []
+    unit_measurement = []   # meters
+    for name, type_name, station, pixels, value, unit in measurement_records(measurement_stack, m):
+        if station is not None:
+            name += "_w"+"{0:.1f}".format(station)
+        pixel_measurement.append([name, "{0:.2f}".format(pixels), "Degrees" if unit == "Degrees" else "Pixels"])
+        unit_measurement.append([name, "{0:.2f}".format(value), unit])
+    return pixel_measurement, unit_measurement
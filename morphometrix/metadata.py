@@ -0,0 +1,211 @@
+import os, re, json, struct, zlib, threading
+
+# ------------------------------
+#   MorphoMetrix Image Metadata
+#   Reads focal length (EXIF), relative altitude (drone XMP) and pixel dimension
+#   (sensor width from CAMERA_SENSORS or EXIF focal plane resolution) from png/jpeg files
+#   Parsed values are cached per folder in a MetadataIndex
+# ------------------------------
+
+# Sensor width (mm) by EXIF camera model, pixel dimension = sensor width / image width
+CAMERA_SENSORS = {
+    "FC220": 6.17,          # DJI Mavic Pro
+    "FC2103": 6.17,         # DJI Mavic Air
+    "FC7303": 6.17,         # DJI Mini 2
+    "FC330": 6.17,          # DJI Phantom 4
+    "FC6310": 13.2,         # DJI Phantom 4 Pro
+    "FC6310S": 13.2,        # DJI Phantom 4 Pro V2
+    "FC6510": 13.2,         # DJI Zenmuse X4S
+    "FC6520": 17.3,         # DJI Zenmuse X5S
+    "L1D-20c": 13.2,        # DJI Mavic 2 Pro
+    "L2D-20c": 17.3,        # DJI Mavic 3
+}
+
+# EXIF tags
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_FOCAL_LENGTH = 0x920A
+TAG_FOCAL_PLANE_X_RESOLUTION = 0xA20E
+TAG_FOCAL_PLANE_RESOLUTION_UNIT = 0xA210
+
+FOCAL_PLANE_UNITS = {2: 25.4, 3: 10.0, 4: 1.0}   # EXIF resolution unit -> mm (inch, cm, mm)
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+RELATIVE_ALTITUDE = re.compile(rb'RelativeAltitude\s*(?:=\s*["\']|>)\s*([+-]?[0-9.]+)')
+
+# Read width and height of png/jpeg image from its header
+def image_size(path):
+    with open(path, 'rb') as f:
+        head = f.read(24)
+        if head[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                marker, length = struct.unpack('>HH', f.read(4))
+                if 0xffc0 <= marker <= 0xffcf and marker not in (0xffc4, 0xffc8, 0xffcc):   # Start of frame
+                    h, w = struct.unpack('>xHH', f.read(5))
+                    return w, h
+                f.seek(length - 2, 1)
+    raise ValueError("Unsupported image format: " + path)
+
+# EXIF (TIFF structure) and XMP packet of png/jpeg file, None where missing
+def read_segments(path):
+    exif, xmp = None, None
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                marker, length = struct.unpack('>HH', f.read(4))
+                if marker == 0xffda:    # Start of scan, no metadata after it
+                    break
+                data = f.read(length - 2)
+                if marker == 0xffe1 and data.startswith(b'Exif\x00\x00'):
+                    exif = data[6:]
+                elif marker == 0xffe1 and data.startswith(b'http://ns.adobe.com/xap/1.0/\x00'):
+                    xmp = data[29:]
+        elif head == b'\x89PNG\r\n\x1a\n':
+            while True:
+                length, kind = struct.unpack('>I4s', f.read(8))
+                if kind in (b'IDAT', b'IEND'):
+                    break
+                data = f.read(length)
+                f.seek(4, 1)    # crc
+                if kind == b'eXIf':
+                    exif = data
+                elif kind == b'iTXt' and data.startswith(b'XML:com.adobe.xmp\x00'):
+                    compressed = data[18]
+                    text = data[20:].split(b'\x00', 2)[-1]  # Skip language and translated keyword
+                    xmp = zlib.decompress(text) if compressed else text
+    return exif, xmp
+
+# Tags of one TIFF IFD as {tag: value}, rationals as floats, single values unwrapped
+def read_ifd(tiff, offset, order):
+    tags = {}
+    count, = struct.unpack(order + 'H', tiff[offset:offset+2])
+    for i in range(count):
+        entry = offset + 2 + 12*i
+        tag, kind, n = struct.unpack(order + 'HHI', tiff[entry:entry+8])
+        if kind not in TYPE_SIZES:
+            continue
+        size = TYPE_SIZES[kind]*n
+        start = entry + 8 if size <= 4 else struct.unpack(order + 'I', tiff[entry+8:entry+12])[0]
+        raw = tiff[start:start+size]
+        match kind:
+            case 2:
+                value = raw.split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+            case 5 | 10:
+                fmt = order + ('%dI' if kind == 5 else '%di') % (2*n)
+                parts = struct.unpack(fmt, raw)
+                values = [a/b if b else 0.0 for a, b in zip(parts[::2], parts[1::2])]
+                value = values[0] if n == 1 else values
+            case 3 | 4 | 9:
+                values = struct.unpack(order + {3: '%dH', 4: '%dI', 9: '%di'}[kind] % n, raw)
+                value = values[0] if n == 1 else values
+            case _:
+                value = raw
+        tags[tag] = value
+    return tags
+
+# IFD0 and Exif IFD tags of EXIF data
+def read_exif(tiff):
+    order = '<' if tiff[:2] == b'II' else '>'
+    tags = read_ifd(tiff, struct.unpack(order + 'I', tiff[4:8])[0], order)
+    if TAG_EXIF_IFD in tags:
+        tags.update(read_ifd(tiff, tags[TAG_EXIF_IFD], order))
+    return tags
+
+# Measurement metadata of image: focal_length (mm), altitude (m), pixel_dimension (mm/pixel)
+# Only values found in the file are returned, with camera make and model when present
+def read_metadata(path):
+    metadata = {}
+    exif, xmp = read_segments(path)
+    if exif:
+        tags = read_exif(exif)
+        if tags.get(TAG_MAKE):
+            metadata["make"] = tags[TAG_MAKE]
+        if tags.get(TAG_MODEL):
+            metadata["model"] = tags[TAG_MODEL]
+        if tags.get(TAG_FOCAL_LENGTH):
+            metadata["focal_length"] = tags[TAG_FOCAL_LENGTH]
+
+        sensor_width = CAMERA_SENSORS.get(tags.get(TAG_MODEL))
+        if sensor_width:
+            metadata["pixel_dimension"] = sensor_width / max(image_size(path))     # Sensor width is along long edge
+        elif tags.get(TAG_FOCAL_PLANE_X_RESOLUTION):    # Pixels per resolution unit on sensor
+            unit = FOCAL_PLANE_UNITS.get(tags.get(TAG_FOCAL_PLANE_RESOLUTION_UNIT, 2))
+            if unit:
+                metadata["pixel_dimension"] = unit / tags[TAG_FOCAL_PLANE_X_RESOLUTION]
+    if xmp:
+        match = RELATIVE_ALTITUDE.search(xmp)
+        if match:
+            metadata["altitude"] = float(match.group(1))
+    return metadata
+
+class MetadataIndex():
+    """
+    Metadata of every image in one folder, stored in FILENAME inside the folder.
+    Entries are keyed by file name and only reused while the file mtime and size match,
+    so a folder is parsed once and edited images are parsed again.
+    """
+
+    FILENAME = ".morphometrix_metadata.json"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.scanning = None        # Thread of running scan
+        self.dirty = False
+        try:
+            with open(os.path.join(folder, self.FILENAME)) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    # Metadata of image at path, parsed only if not indexed or changed
+    def get(self, path):
+        st = os.stat(path)
+        name = os.path.basename(path)
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None or entry["mtime"] != st.st_mtime or entry["size"] != st.st_size:
+            try:
+                metadata = read_metadata(path)
+            except Exception:   # Truncated, corrupt or unknown file (zlib, struct, type errors...), nothing to fill
+                metadata = {}
+            entry = {"mtime": st.st_mtime, "size": st.st_size, "metadata": metadata}
+            with self.lock:
+                self.entries[name] = entry
+                self.dirty = True
+            if self.scanning is None:
+                self.save()
+        return entry["metadata"]
+
+    # Index every image of paths, then save index
+    def scan(self, paths):
+        for path in paths:
+            self.get(path)
+        self.scanning = None
+        self.save()
+
+    # Run scan on a daemon thread, returns immediately
+    def scan_in_background(self, paths):
+        self.scanning = threading.Thread(target = self.scan, args = (list(paths),), daemon = True)
+        self.scanning.start()
+
+    # Write index if it changed, folders that are not writable are just not cached
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entries)
+            self.dirty = False
+        path = os.path.join(self.folder, self.FILENAME)
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
@@ -0,0 +1,69 @@
+import json
+import numpy as np
+from geometry import BezierCurve, SplineCurve
+from measurement import Measurement, consts
+
+# ------------------------------
+#   MorphoMetrix Project File
+#   Saves a measurement session as an uncompressed numpy .npz archive:
+#       "header"       JSON (utf-8 bytes) of format version, metadata and one entry per measurement
+#       "<i>/<array>"  arrays of i-th measurement on stack (points, P, Q, polygon, centers, ends, handles)
+#   Members of an .npz are only read when accessed, loading touches nothing but the header
+#   and the arrays the stack needs
+# ------------------------------
+
+PROJECT_VERSION = 1
+PROJECT_EXTENSION = ".mmx.npz"
+
+CURVE_TYPES = {"bezier": BezierCurve, "spline": SplineCurve}
+
+# Write measurement stack and metadata dict (image path, Window fields, measuring state) to path
+def save_project(path, measurement_stack, metadata):
+    arrays = {}
+    entries = []
+    for i, measurement in enumerate(measurement_stack):
+        entry = {"type": measurement.measurement_type, "name": measurement.measurement_name,
+                 "value": measurement.measurement_value}
+        arrays["%d/points" % i] = measurement.points.array
+        if measurement.curve is not None:
+            entry["curve"] = "spline" if isinstance(measurement.curve, SplineCurve) else "bezier"
+            arrays["%d/P" % i] = measurement.curve.P
+            if isinstance(measurement.curve, BezierCurve):
+                entry["kb"] = measurement.curve.kb
+                arrays["%d/Q" % i] = measurement.curve.Q
+        for field in ("polygon", "centers", "ends", "handles"):
+            if getattr(measurement, field) is not None:
+                arrays["%d/%s" % (i, field)] = getattr(measurement, field)
+        entries.append(entry)
+
+    header = {"version": PROJECT_VERSION, "metadata": metadata, "measurements": entries}
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype = np.uint8)
+    with open(path, "wb") as f:     # np.savez appends .npz to bare file names
+        np.savez(f, **arrays)
+
+# Read project file, returns (measurement stack, metadata dict)
+def load_project(path):
+    with np.load(path, allow_pickle = False) as archive:
+        header = json.loads(archive["header"].tobytes().decode("utf-8"))
+        if header["version"] > PROJECT_VERSION:
+            raise ValueError("Project was saved by a newer version of MorphoMetriX")
+
+        measurement_stack = []
+        for i, entry in enumerate(header["measurements"]):
+            measurement = Measurement(entry["type"], entry["name"])
+            points = archive["%d/points" % i]
+            if measurement.measurement_type == consts.AREA:
+                for x, y in points:     # Rebuilds edge index, so area can be reopened and continued
+                    measurement.add_point(x, y)
+            else:
+                measurement.points.extend(points)
+            if "curve" in entry:    # Refit from stored control points, costs one quadrature
+                measurement.curve = CURVE_TYPES[entry["curve"]](archive["%d/P" % i])
+            for field in ("polygon", "centers", "ends", "handles"):
+                key = "%d/%s" % (i, field)
+                if key in archive.files:
+                    setattr(measurement, field, archive[key])
+            measurement.measurement_value = entry["value"]
+            measurement.revision += 1
+            measurement_stack.append(measurement)
+    return measurement_stack, header["metadata"]
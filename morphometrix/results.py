@@ -0,0 +1,56 @@
+import sqlite3
+from datetime import datetime
+from measurement import measurement_records
+
+# ------------------------------
+#   MorphoMetrix Results Store
+#   One SQLite table holding every exported measurement of every image,
+#   one row per measurement (per width station) with full precision values
+# ------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    image_id        TEXT,
+    image_path      TEXT,
+    exported        TEXT,
+    focal_length    REAL,
+    altitude        REAL,
+    pixel_dimension REAL,
+    mirror_side     TEXT,
+    notes           TEXT,
+    name            TEXT,
+    type            TEXT,
+    station         REAL,
+    value_pixels    REAL,
+    value           REAL,
+    unit            TEXT
+);
+CREATE INDEX IF NOT EXISTS measurements_image_id ON measurements (image_id);
+"""
+
+COLUMNS = ("image_id", "image_path", "exported", "focal_length", "altitude", "pixel_dimension", "mirror_side", "notes",
+           "name", "type", "station", "value_pixels", "value", "unit")
+
+# Rows (ordered as COLUMNS) of measurement stack of one image
+# Values are unrounded, value is in meters (square meters for areas, degrees for angles)
+def result_rows(measurement_stack, image_id, image_path, focal, altitude, pixeldim, side, notes):
+    m = pixeldim * (altitude / focal)
+    metadata = (image_id, image_path, datetime.now().isoformat(timespec = "seconds"), focal, altitude, pixeldim, side, notes)
+    return [metadata + record for record in measurement_records(measurement_stack, m)]
+
+# Append measurement stack of one image to results store at path, created on first use
+def append_results(path, measurement_stack, image_id, image_path, focal, altitude, pixeldim, side, notes):
+    rows = result_rows(measurement_stack, image_id, image_path, focal, altitude, pixeldim, side, notes)
+    append_rows(path, rows)
+    return len(rows)
+
+# Append rows (tuples ordered as COLUMNS) in one transaction
+def append_rows(path, rows):
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute("PRAGMA journal_mode = WAL")     # Appends do not block readers
+        connection.executescript(SCHEMA)
+        with connection:
+            connection.executemany("INSERT INTO measurements (%s) VALUES (%s)" % (", ".join(COLUMNS), ", ".join("?"*len(COLUMNS))), rows)
+    finally:
+        connection.close()
@@ -0,0 +1,54 @@
+from PySide6.QtCore import QObject, QTimer
+from instrumentation import profiler
+import time
+
+# ------------------------------
+#   MorphoMetrix Render Scheduler
+#   Collapses bursts of slider, mouse and wheel events into one update per event loop pass
+#   Requests are keyed, a request for a key already pending replaces it and counts as skipped
+#   While profiling, "<key> lag" times each flush from the first request of its burst (input to update)
+# ------------------------------
+
+class RenderScheduler(QObject):
+    def __init__(self, parent = None):
+        super(RenderScheduler, self).__init__(parent)
+        self.pending = {}       # key -> callback run on next flush, latest request wins
+        self.first = {}         # key -> perf_counter time of first pending request
+        self.requested = 0      # Requests made
+        self.flushed = 0        # Callbacks run
+        self.skipped = 0        # Requests replaced by a later one before running
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)       # Fires once queued input events are handled
+        self.timer.timeout.connect(self.flush)
+
+    # Run callback on next flush instead of now
+    def schedule(self, key, callback):
+        self.requested += 1
+        if key in self.pending:
+            self.skipped += 1
+        else:
+            self.first[key] = time.perf_counter()
+        self.pending[key] = callback
+        if not self.timer.isActive():
+            self.timer.start()
+
+    # Drop pending request of key, e.g. when its state is reset
+    def cancel(self, key):
+        self.pending.pop(key, None)
+        self.first.pop(key, None)
+
+    # Run pending callbacks, in order first requested
+    def flush(self):
+        self.timer.stop()
+        pending, self.pending = self.pending, {}
+        first, self.first = self.first, {}
+        for key, callback in pending.items():
+            callback()
+            if profiler.enabled:
+                profiler.record(key + " lag", first[key], time.perf_counter())
+        self.flushed += len(pending)
+
+    # Counter summary for status bar
+    def summary(self):
+        return "%d updates, %d skipped" % (self.flushed, self.skipped)
@@ -0,0 +1,166 @@
+from PySide6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PySide6.QtGui import QImage, QImageReader, QPixmap
+from PySide6.QtCore import Qt, QRect, QRectF
+from collections import OrderedDict
+import math, itertools
+import numpy as np
+
+# ------------------------------
+#   MorphoMetrix Tiled Image
+#   Background image drawn from a multi-resolution tile pyramid
+#   Scene coordinates are always full resolution image pixels
+#
+#   The full resolution image stays resident, width snapping and export read it, so an image
+#   takes about 4/3 of its decoded size once every level is built (ImagePyramid.nbytes).
+#   Zoomed in, it is drawn directly rather than copied into tiles, only the smaller levels
+#   are cached as tile pixmaps
+# ------------------------------
+
+TILE_SIZE = 512                 # Tile edge (pixels) at every pyramid level
+TILE_CACHE_BYTES = 256 << 20    # Default memory budget of tile cache
+
+# Decode full image, without Qt's allocation limit that rejects very large frames
+def read_image(path):
+    reader = QImageReader(path)
+    reader.setAllocationLimit(0)
+    image = reader.read()
+    if image.isNull():
+        raise IOError(reader.errorString())
+    return image
+
+class TileCache():
+    """
+    Least recently used tile pixmaps of downsampled levels, keyed by (pyramid, level, column, row).
+    Oldest tiles are dropped once the pixmaps hold more than budget bytes.
+    """
+
+    def __init__(self, budget = TILE_CACHE_BYTES):
+        self.budget = budget
+        self.tiles = OrderedDict()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def get(self, key):
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        self.tiles[key] = pixmap
+        self.bytes += pixmap.width()*pixmap.height()*pixmap.depth()//8
+        while self.bytes > self.budget and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last = False)
+            self.bytes -= old.width()*old.height()*old.depth()//8
+
+    def clear(self):
+        self.tiles.clear()
+        self.bytes = 0
+
+class ImagePyramid():
+    """
+    Full resolution image and its successive half size levels.
+    Level k is built on first use by halving level k-1, the last level fits in a single tile.
+    """
+
+    ids = itertools.count()     # Tells tiles of different images apart in a shared cache
+
+    def __init__(self, image, tile_size = TILE_SIZE):
+        self.id = next(self.ids)
+        self.tile_size = tile_size
+        self.levels = [image]
+        self.gray = None            # Grayscale8 copy of full resolution image, backs luminance()
+        self.count = max(1, math.ceil(math.log2(max(image.width(), image.height(), 1)/tile_size)) + 1)
+
+    def width(self):
+        return self.levels[0].width()
+
+    def height(self):
+        return self.levels[0].height()
+
+    # Build every level, safe to call off the GUI thread
+    def build(self):
+        self.level(self.count - 1)
+        return self
+
+    # Memory held by built levels
+    def nbytes(self):
+        return sum(level.sizeInBytes() for level in self.levels) + (self.gray.sizeInBytes() if self.gray is not None else 0)
+
+    # Full resolution luminance as (H,W) uint8 array, converted on first use
+    # The array is a view of self.gray, valid as long as the pyramid is
+    def luminance(self):
+        if self.gray is None:
+            self.gray = self.levels[0].convertToFormat(QImage.Format.Format_Grayscale8)
+        gray = self.gray
+        return np.frombuffer(gray.constBits(), np.uint8, gray.sizeInBytes()).reshape(gray.height(), gray.bytesPerLine())[:, :gray.width()]
+
+    def level(self, k):
+        while len(self.levels) <= k:
+            last = self.levels[-1]
+            self.levels.append(last.scaled((last.width() + 1)//2, (last.height() + 1)//2,
+                                           Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation))
+        return self.levels[k]
+
+    # Pyramid level whose resolution is closest above scale (screen pixels per image pixel)
+    def level_for_scale(self, scale):
+        if scale <= 0:
+            return self.count - 1
+        return min(max(int(math.floor(math.log2(1/scale))), 0), self.count - 1)
+
+class TiledImageItem(QGraphicsItem):
+    """
+    Paints only tiles in the exposed rect, from the pyramid level matching the view zoom.
+    Tile pixmaps are made on first paint and kept in a TileCache, the full resolution
+    level is painted straight from its image instead so it is not held twice.
+    """
+
+    def __init__(self, pyramid, cache):
+        super(TiledImageItem, self).__init__()
+        self.pyramid = pyramid
+        self.cache = cache
+        self.bounds = QRectF(0, 0, self.pyramid.width(), self.pyramid.height())
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)   # Fills option.exposedRect
+
+    def width(self):
+        return self.pyramid.width()
+
+    def height(self):
+        return self.pyramid.height()
+
+    # Pixmap of tile (col, row) at pyramid level k
+    def tile(self, k, col, row):
+        key = (self.pyramid.id, k, col, row)
+        pixmap = self.cache.get(key)
+        if pixmap is None:
+            ts = self.pyramid.tile_size
+            level = self.pyramid.level(k)
+            pixmap = QPixmap.fromImage(level.copy(QRect(col*ts, row*ts, ts, ts).intersected(level.rect())))   # Edge tiles are cut short
+            self.cache.put(key, pixmap)
+        return pixmap
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget = None):
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        k = self.pyramid.level_for_scale(scale)
+        level = self.pyramid.level(k)
+        sx, sy = self.width()/level.width(), self.height()/level.height()    # Level pixel -> image pixel
+        ts = self.pyramid.tile_size
+        exposed = option.exposedRect.intersected(self.bounds)
+        if exposed.isEmpty():
+            return
+        if k == 0:
+            source = QRectF(exposed.toAlignedRect().intersected(level.rect()))
+            painter.drawImage(source, level, source)
+            return
+        cols = range(int(exposed.left()/(ts*sx)), min(int(math.ceil(exposed.right()/(ts*sx))), math.ceil(level.width()/ts)))
+        rows = range(int(exposed.top()/(ts*sy)), min(int(math.ceil(exposed.bottom()/(ts*sy))), math.ceil(level.height()/ts)))
+        for row in rows:
+            for col in cols:
+                pixmap = self.tile(k, col, row)
+                target = QRectF(col*ts*sx, row*ts*sy, pixmap.width()*sx, pixmap.height()*sy)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))